@@ -0,0 +1,185 @@
+from pathlib2 import Path
+import numpy as np
+import tracemalloc
+import argparse
+import platform
+import time
+import json
+import gc
+import os
+
+ap = argparse.ArgumentParser(description="Time the io, preprocessing and model hot paths on synthetic datasets and compare to a baseline")
+ap.add_argument("-s", "--sizes", type=int, nargs="+", default=[128, 256, 384],
+	help="side of the cubic scans of each synthetic dataset")
+ap.add_argument("-r", "--repeats", type=int, default=3,
+	help="times each benchmark is run, the fastest is kept")
+ap.add_argument("-o", "--only", type=str, nargs="*", default=None,
+	help="names of benchmarks to run, all if not given")
+ap.add_argument("-d", "--data", type=str, default="output/benchmarks/data",
+	help="folder the synthetic datasets are made in, they are reused between runs")
+ap.add_argument("-b", "--baseline", type=str, default="benchmark_baseline.json",
+	help="results to compare against")
+ap.add_argument("--save-baseline", action="store_true",
+	help="write these results as the new baseline")
+ap.add_argument("-t", "--tolerance", type=float, default=0.25,
+	help="fraction slower or bigger than the baseline that counts as a regression")
+args = vars(ap.parse_args())
+
+
+class Skip(Exception):
+	"""
+	Raised by a benchmark that can't run on this dataset, anything else raised is a failure
+	"""
+
+
+# tensorflow allocates outside python so tracemalloc can't see these, they get peak RSS instead
+MODEL_BENCHMARKS = ['unet_predict']
+
+
+def measure(fn, repeats, traced=True):
+	"""
+	Fastest and mean wall time of fn, and if traced the peak memory python and numpy allocated while it ran
+	Otherwise the peak RSS of the whole process so far is recorded, which isn't compared to the baseline
+	"""
+	times = []
+	for _ in range(repeats):
+		gc.collect()
+		start = time.perf_counter()
+		fn()
+		times.append(time.perf_counter() - start)
+	result = {
+		'seconds'		: round(min(times), 4),
+		'mean_seconds'	: round(float(np.mean(times)), 4),
+	}
+	if not traced:
+		from ctfishpy import peak_rss_mb
+		result['peak_rss_mb'] = peak_rss_mb()[0]
+		return result
+	# tracemalloc slows allocation heavy code down so memory gets its own run
+	gc.collect()
+	tracemalloc.start()
+	try:
+		fn()
+		peak = tracemalloc.get_traced_memory()[1]
+	finally:
+		tracemalloc.stop()
+	result['peak_mb'] = round(peak / 2**20, 1)
+	return result
+
+
+def make_dataset(size, folder):
+	"""
+	Synthetic dataset with cubic scans of side size, made once and reused
+	"""
+	import ctfishpy
+	path = Path(folder) / str(size)
+	if not (path / 'uCT_mastersheet.csv').is_file():
+		ctfishpy.SyntheticDataset(path, fish_nums=[40, 41], shape=(size, size, size), labelled=1., seed=size).generate()
+	return path
+
+
+def benchmarks(size, path):
+	"""
+	{name : function} of everything to time on one dataset
+	"""
+	import ctfishpy
+	# CTreader finds the dataset through DATASET_PATH, .env doesn't override it
+	os.environ['DATASET_PATH'] = str(path.absolute())
+	ctreader = ctfishpy.CTreader()
+	lumpfish = ctfishpy.Lumpfish()
+	n = 40
+	ct, metadata = ctreader.read(n)
+	r = size // 4
+
+	# random weights predict as fast as trained ones, so no trained model is needed
+	unet = ctfishpy.Unet()
+	if not os.path.isfile(unet.weightspath): unet.weightspath = None
+
+	def unet_predict():
+		unet.predict(n)
+
+	def data_genie():
+		# dataGenie crops a 125 x 224 x 224 roi so needs scans at least that big
+		if size < 224: raise Skip('scans too small for the dataGenie roi')
+		ctfishpy.dataGenie(batch_size=8, data_gen_args={}, fish_nums=[40, 41])
+
+	return {
+		'read_full'				: lambda : ctreader.read(n),
+		'read_range'			: lambda : ctreader.read(n, r=(size // 4, 3 * size // 4)),
+		'read_aligned'			: lambda : ctreader.read(n, align=True),
+		'read_label'			: lambda : ctreader.read_label('Otoliths', n),
+		'rotate_volume'			: lambda : [ctreader.rotate_image(s, 30) for s in ct],
+		'to8bit'				: lambda : ctreader.to8bit(ct),
+		'thresh_stack'			: lambda : ctreader.thresh_stack(ct, 100),
+		'make_max_projections'	: lambda : ctreader.make_max_projections(ct),
+		'lumpfish_crop'			: lambda : lumpfish.crop(ct, [[size // 2, size // 2, r]], scale=[40, 40]),
+		'datagenie'				: data_genie,
+		'unet_predict'			: unet_predict,
+	}
+
+
+def compare(results, baseline, tolerance):
+	"""
+	Benchmarks that failed, were skipped but ran in the baseline,
+	or are slower or bigger than baseline by more than tolerance
+	"""
+	regressions = []
+	for size, benches in results.items():
+		for name, result in benches.items():
+			if 'error' in result:
+				regressions.append(f"{size} {name} failed: {result['error']}")
+				continue
+			base = baseline.get(size, {}).get(name)
+			if base is None or 'seconds' not in base: continue
+			if 'skipped' in result:
+				regressions.append(f"{size} {name} skipped but ran in the baseline: {result['skipped']}")
+				continue
+			for key in ['seconds', 'peak_mb']:
+				if key not in base or key not in result: continue
+				if result[key] > base[key] * (1 + tolerance) and result[key] - base[key] > 0.01:
+					regressions.append(f'{size} {name} {key}: {base[key]} -> {result[key]}')
+	return regressions
+
+
+if __name__ == "__main__":
+	results = {}
+	for size in args['sizes']:
+		path = make_dataset(size, args['data'])
+		results[str(size)] = {}
+		for name, fn in benchmarks(size, path).items():
+			if args['only'] and name not in args['only']: continue
+			try:
+				result = measure(fn, args['repeats'], traced=name not in MODEL_BENCHMARKS)
+			except Skip as e:
+				result = {'skipped' : str(e)}
+			except Exception as e:
+				result = {'error' : repr(e)}
+			results[str(size)][name] = result
+			print(f"[benchmark] {size:>5} {name:<22} {result}")
+
+	output = Path('output/benchmarks')
+	output.mkdir(parents=True, exist_ok=True)
+	report = {
+		'time'		: time.strftime('%Y-%m-%d %H:%M:%S'),
+		'machine'	: {'platform' : platform.platform(), 'python' : platform.python_version(), 'numpy' : np.__version__, 'cpus' : os.cpu_count()},
+		'results'	: results,
+	}
+	with open(output / 'latest.json', 'w') as f:
+		json.dump(report, f, indent=4)
+
+	if args['save_baseline']:
+		failed = compare(results, {}, args['tolerance'])
+		for r in failed: print(f'[benchmark] {r}')
+		if failed: raise SystemExit(f'[benchmark] not saving a baseline with {len(failed)} failed benchmarks')
+		with open(args['baseline'], 'w') as f:
+			json.dump(report, f, indent=4)
+		print(f"[benchmark] saved baseline to {args['baseline']}")
+	else:
+		if not os.path.isfile(args['baseline']):
+			raise SystemExit(f"[benchmark] no baseline at {args['baseline']}, make one on this machine with --save-baseline")
+		with open(args['baseline'], 'r') as f:
+			baseline = json.load(f)['results']
+		regressions = compare(results, baseline, args['tolerance'])
+		for r in regressions: print(f'[benchmark] regression {r}')
+		print(f"[benchmark] {len(regressions)} regressions against {args['baseline']}")
+		if regressions: raise SystemExit(1)
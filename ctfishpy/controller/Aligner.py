@@ -0,0 +1,214 @@
+from .CTreader import CTreader
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import json
+import cv2
+
+
+def mask_axes(mask):
+	"""
+	Centroid, principal axis angle in degrees and elongation (ratio of axis lengths) of a binary mask
+	"""
+	ys, xs = np.nonzero(mask)
+	if len(xs) < 3: return None, 0., 1.
+	centroid = (float(xs.mean()), float(ys.mean()))
+	evals, evecs = np.linalg.eigh(np.cov(np.stack([xs, ys]).astype('float64')))
+	# eigh sorts ascending so the major axis is last
+	major = evecs[:, 1]
+	angle = float(np.degrees(np.arctan2(major[1], major[0])))
+	elongation = float(np.sqrt(evals[1] / evals[0])) if evals[0] > 0 else float('inf')
+	return centroid, angle, elongation
+
+
+class Aligner():
+	"""
+	Estimate alignment angles from axial max projections without the spinner
+
+	PCA of the thresholded bone mask gives the fish's long axis up to 180 degrees.
+	A coarse search around each quarter turn from it then picks the rotation that best matches
+	the mean of the saved projections of fish already aligned by hand in angles.json.
+	Saved projections are aligned so estimates are made on projections of the raw scan.
+	Angles are in the convention of CTreader.rotate_image so read(align=True) can use them.
+
+	Fish that are round (low elongation) or where another direction matches about as well
+	are flagged ambiguous so only they need the spinner.
+
+	parameters
+	thresh : 8 bit threshold of bone in projections
+	size : projections are scaled so their longest side is this many pixels
+	span, step : degrees searched either side of each quarter turn from the PCA estimate
+	n_reference : hand aligned fish averaged into the reference
+	min_elongation, min_margin : confidence limits below which a fish is ambiguous
+	"""
+
+	def __init__(self, thresh=100, size=256, span=10, step=1, n_reference=20,
+				min_elongation=1.2, min_margin=0.05, ctreader=None):
+		self.ctreader = ctreader if ctreader else CTreader()
+		self.thresh = thresh
+		self.size = size
+		self.span = span
+		self.step = step
+		self.n_reference = n_reference
+		self.min_elongation = min_elongation
+		self.min_margin = min_margin
+		self.reference = None
+		self.confidence_path = self.ctreader.dataset_path / 'Metadata/angle_confidence.json'
+
+	def raw_projection(self, n):
+		"""
+		8 bit axial projection of the scan of fish n as it was reconstructed
+		"""
+		ct, metadata = self.ctreader.read(n)
+		return self.ctreader.to8bit(np.max(ct, axis=0))
+
+	def projection(self, n, align=False):
+		"""
+		Axial projection of fish n as float32 scaled to self.size
+
+		parameters
+		align : use the saved projection, made from the scan aligned with angles.json
+		"""
+		if align:
+			z = self.ctreader.read_max_projections(n)[0]
+			if z is None:
+				ct, metadata = self.ctreader.read(n, align=True)
+				z = self.ctreader.to8bit(np.max(ct, axis=0))
+		else:
+			z = self.raw_projection(n)
+		if z.ndim == 3: z = cv2.cvtColor(z, cv2.COLOR_BGR2GRAY)
+		scale = self.size / max(z.shape)
+		if scale < 1: z = cv2.resize(z, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+		return z.astype('float32')
+
+	def window(self, img, angle, centroid):
+		"""
+		img rotated by angle about the mask centroid and cropped around it
+		so fish in different places of the scan can be compared
+		"""
+		half = self.size // 2
+		rot_mat = cv2.getRotationMatrix2D(centroid, angle, 1.0)
+		# move the centroid to the middle of the window
+		rot_mat[:, 2] += (half - centroid[0], half - centroid[1])
+		return cv2.warpAffine(img, rot_mat, (2 * half, 2 * half), flags=cv2.INTER_LINEAR)
+
+	def build_reference(self):
+		"""
+		Mean window of the aligned projections of fish already in angles.json
+		"""
+		with open(self.ctreader.anglePath, 'r') as fp:
+			angles = json.load(fp)
+		fish = sorted(angles, key=int)[:self.n_reference]
+		windows = []
+		for n in fish:
+			img = self.projection(int(n), align=True)
+			centroid, _, _ = mask_axes(img > self.thresh)
+			if centroid is None: continue
+			# already aligned so only centred, not rotated again
+			windows.append(self.normalise(self.window(img, 0, centroid)))
+		if windows: self.reference = self.normalise(np.mean(windows, axis=0))
+		return self.reference
+
+	def normalise(self, img):
+		img = img - img.mean()
+		norm = np.sqrt((img ** 2).sum())
+		return img / norm if norm else img
+
+	def score(self, window):
+		if self.reference is not None:
+			return float((self.normalise(window) * self.reference).sum())
+		# without a reference only left right symmetry can be used, which can't tell up from down
+		window = self.normalise(window)
+		return float((window * window[:, ::-1]).sum())
+
+	def estimate(self, n):
+		"""
+		Estimate the alignment angle of fish n
+
+		returns angle in degrees and dict with elongation of the bone mask,
+		score margin between the best and the next best quarter turn and whether it is ambiguous
+		"""
+		img = self.projection(n)
+		centroid, axis, elongation = mask_axes(img > self.thresh)
+		if centroid is None: raise ValueError(f'[Aligner] fish {n} has no bone above threshold {self.thresh}')
+
+		# where the long axis ends up in the reference depends on the dataset
+		# and PCA can't tell head from tail, so every quarter turn from it is searched
+		offsets = np.arange(-self.span, self.span + self.step, self.step)
+		best = {}
+		for turn in [0, 90, 180, 270]:
+			scores = [(self.score(self.window(img, axis + turn + o, centroid)), axis + turn + o) for o in offsets]
+			best[turn] = max(scores)
+
+		(top, angle), (second, _) = sorted(best.values(), reverse=True)[:2]
+		margin = top - second
+		ambiguous = self.reference is None or elongation < self.min_elongation or margin < self.min_margin
+		score = {
+			'elongation'	: round(elongation, 3),
+			'margin'		: round(margin, 3),
+			'ambiguous'		: bool(ambiguous),
+		}
+		return round(float(angle) % 360, 1), score
+
+	def estimate_many(self, fish_list=None, overwrite=False, workers=4):
+		"""
+		Estimate angles of every fish in fish_list missing from angles.json and add them,
+		with their confidence in Metadata/angle_confidence.json
+
+		Fish that raise are left out of angles.json and get a score of
+		{'error' : message, 'ambiguous' : True} so review() sends them to the spinner.
+
+		returns {fish : score} of the fish attempted
+		"""
+		if fish_list is None: fish_list = self.ctreader.fish_nums
+		with open(self.ctreader.anglePath, 'r') as fp:
+			angles = json.load(fp)
+		confidence = {}
+		if self.confidence_path.is_file():
+			with open(self.confidence_path, 'r') as fp:
+				confidence = json.load(fp)
+		if self.reference is None: self.build_reference()
+		todo = [n for n in fish_list if overwrite or str(n) not in angles]
+
+		def attempt(n):
+			# one bad scan shouldn't lose the rest of the run
+			try: return self.estimate(n)
+			except Exception as e: return None, {'error' : repr(e), 'ambiguous' : True}
+
+		estimated = {}
+		with ThreadPoolExecutor(workers) as pool:
+			for n, (angle, score) in zip(todo, pool.map(attempt, todo)):
+				confidence[str(n)] = score
+				estimated[n] = score
+				if angle is None:
+					print(f"[Aligner] fish {n} failed {score['error']}")
+					continue
+				angles[str(n)] = angle
+				print(f"[Aligner] fish {n} angle {angle}{' ambiguous' if score['ambiguous'] else ''}")
+
+		with open(self.ctreader.anglePath, 'w') as fp:
+			json.dump(angles, fp)
+		with open(self.confidence_path, 'w') as fp:
+			json.dump(confidence, fp, sort_keys=True, indent=4)
+		return estimated
+
+	def review(self, fish_list=None):
+		"""
+		Open the spinner for ambiguous fish and save the angles set by hand
+		"""
+		with open(self.confidence_path, 'r') as fp:
+			confidence = json.load(fp)
+		if fish_list is None: fish_list = [int(n) for n, s in confidence.items() if s['ambiguous']]
+		with open(self.ctreader.anglePath, 'r') as fp:
+			angles = json.load(fp)
+
+		for n in fish_list:
+			# the spinner sets the angle of the scan as reconstructed, not of the aligned projection
+			z = self.raw_projection(n)
+			angles[str(n)] = self.ctreader.spin(z, None)
+			confidence[str(n)] = {**confidence.get(str(n), {}), 'ambiguous' : False}
+
+		with open(self.ctreader.anglePath, 'w') as fp:
+			json.dump(angles, fp)
+		with open(self.confidence_path, 'w') as fp:
+			json.dump(confidence, fp, sort_keys=True, indent=4)
+		return angles
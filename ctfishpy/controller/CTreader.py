@@ -1,5 +1,6 @@
 from dotenv import load_dotenv
 from ..viewer import *
+from .MasterIndex import MasterIndex
 from pathlib2 import Path
 import tifffile as tiff
 from tqdm import tqdm
@@ -24,20 +25,27 @@ class CTreader:
 		nums.sort()
 		self.fish_nums = nums
 		self.anglePath = self.dataset_path / "Metadata/angles.json"
+		self.index = None
 
 	def mastersheet(self):
 		return self.master
 
+	def query(self, **predicates):
+		"""
+		Fish numbers matching predicates as a numpy array, see MasterIndex.query
+		e.g. ctreader.query(age=(6, 12), genotype={'wt', 'het'}, has_label='Otoliths')
+		The index is built on first use
+		"""
+		if self.index is None: self.index = MasterIndex(self.master, self.dataset_path, self.fish_nums)
+		return self.index.query(**predicates)
+
 	def trim(self, m, col, value):
 		"""
 		Trim df to e.g. fish that are 12 years old
 		Find all rows that have specified value in specified column
 		e.g. find all rows that have 12 in column 'age'
 		"""
-		# delete ones not in index
-		index = list(m.loc[m[col]==value].index.values)
-		trimmed = m.drop(set(m.index) - set(index))
-		return trimmed
+		return m[m[col] == value]
 
 	def list_numbers(self, m):
 		# List numbers of fish in a dictionary after trimming
@@ -173,6 +181,41 @@ class CTreader:
 		dset = f.create_dataset(name=str(n), data = scan, shape=scan.shape, dtype=dtype, compression=compression)
 		f.close()
 
+	def write_pyramid(self, scan, n, dataset, levels=4, tile=256):
+		"""
+		Write a resolution pyramid of a scan for zoomed out viewing
+		Each level halves x and y, slices are chunked in tiles so the viewer reads only what is visible
+
+		parameters
+		scan : array or volume from open()
+		dataset : name of the Compressed/<dataset>_pyramid.h5 store
+		levels : number of levels including full resolution
+		"""
+		folderPath = Path(f'{self.dataset_path}/Compressed/')
+		folderPath.mkdir(parents=True, exist_ok=True)
+		with h5py.File(folderPath / f'{dataset}_pyramid.h5', 'a') as f:
+			if str(n) in f: del f[str(n)]
+			group = f.create_group(str(n))
+			shape = scan.shape
+			dsets = []
+			for level in range(levels):
+				level_shape = (shape[0],) + tuple(-(-s // 2 ** level) for s in shape[1:])
+				chunks = (1,) + tuple(min(tile, s) for s in level_shape[1:])
+				dsets.append(group.create_dataset(str(level), shape=level_shape, dtype=scan.dtype, chunks=chunks, compression=1))
+			for z in tqdm(range(shape[0])):
+				image = np.asarray(scan[z])
+				for level, dset in enumerate(dsets):
+					if level: image = cv2.resize(image, dset.shape[:0:-1], interpolation=cv2.INTER_AREA)
+					dset[z] = image
+
+	def open_pyramid(self, fish, dataset):
+		"""
+		Levels of a pyramid written by write_pyramid, full resolution first
+		"""
+		f = h5py.File(str(self.dataset_path / f'Compressed/{dataset}_pyramid.h5'), 'r')
+		group = f[str(fish)]
+		return [group[str(level)] for level in range(len(group))]
+
 	def read_max_projections(self, n):
 		"""
 		Return x, y, z which represent axial, saggital, and coronal max projections
@@ -195,11 +238,62 @@ class CTreader:
 		x = np.max(stack, axis=2)
 		return [z, y, x]
 
-	def view(self, ct, label=None, thresh=False):
+	def view(self, ct, label=None, thresh=False, colours=None, opacity=1.):
 		"""
 		Main viewer using PyQt5
+
+		colours : {label value : (r, g, b)} of the label overlay
+		opacity : of the label overlay between 0 and 1
+		"""
+		mainviewer.mainViewer(ct, label, thresh, colours, opacity)
+
+	def view_ortho(self, ct, label=None, colours=None, opacity=1.):
 		"""
-		mainviewer.mainViewer(ct, label, thresh)
+		Linked axial, sagittal and coronal views with a shared crosshair
+		ct can be an array or a volume from open()
+
+		returns [z, x, y] of the crosshair when the window is closed
+		"""
+		return orthoViewer(ct, label, colours, opacity)
+
+	def open(self, fish, dataset=None, align=False):
+		"""
+		Open a scan without reading it, slices are read when indexed
+
+		parameters
+		fish : number of sample
+		dataset : name of a Compressed/<dataset>.h5 store from write_scan, reads the tiffs if None
+		align : rotate tiff slices with angles.json as they are read
+		"""
+		if dataset is not None:
+			# h5py datasets read only the chunks that are indexed
+			f = h5py.File(str(self.dataset_path / f'Compressed/{dataset}.h5'), 'r')
+			return f[str(fish)]
+
+		tifpath = self.dataset_path / "low_res_clean" / str(fish).zfill(3) / "reconstructed_tifs"
+		images = sorted(str(i) for i in tifpath.iterdir())
+		transform = None
+		if align:
+			with open(self.anglePath, "r") as fp:
+				angle = json.load(fp)[str(fish)]
+			transform = lambda image : self.rotate_image(image, angle)
+		return TiffVolume(images, transform)
+
+	def view_scan(self, fish, label=None, dataset=None, align=False, thresh=False, colours=None, opacity=1., cache_size=64):
+		"""
+		View a scan straight from disk through a prefetching slice cache
+		so scrolling is smooth however big the scan is
+		If the dataset has a pyramid from write_pyramid zoomed out views are read from it
+
+		parameters
+		label : optional label stack or h5 dataset
+		cache_size : decoded slices kept in memory
+		"""
+		stack = SliceCache(self.open(fish, dataset, align), size=cache_size)
+		pyramid = None
+		if dataset is not None and (self.dataset_path / f'Compressed/{dataset}_pyramid.h5').is_file():
+			pyramid = self.open_pyramid(fish, dataset)
+		mainviewer.mainViewer(stack, label, thresh, colours, opacity, pyramid)
 
 	def spin(self, img, center, label=None, thresh=False):
 		"""
@@ -0,0 +1,282 @@
+from .CTreader import CTreader
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import json
+import cv2
+
+
+def next_fast_len(n):
+	"""
+	Smallest 2^a 3^b 5^c >= n, fft sizes like this are much faster than primes
+	"""
+	best = 2 * n
+	p5 = 1
+	while p5 < best:
+		p35 = p5
+		while p35 < best:
+			p = p35
+			while p < n: p *= 2
+			best = min(best, p)
+			p35 *= 3
+		p5 *= 5
+	return best
+
+
+def normalise(img):
+	"""
+	Zero mean unit variance float32 copy of img so bright regions don't dominate correlation
+	"""
+	img = img.astype('float32')
+	std = img.std()
+	return (img - img.mean()) / (std if std else 1)
+
+
+def peak_to_sidelobe(corr, peak, exclude=5):
+	"""
+	Height of the correlation peak above the rest of the map in standard deviations
+	"""
+	mask = np.ones(corr.shape, dtype=bool)
+	mask[tuple(slice(max(0, p-exclude), p+exclude+1) for p in peak)] = False
+	side = corr[mask]
+	std = side.std()
+	return float((corr[tuple(peak)] - side.mean()) / std) if std else 0.
+
+
+def downsample(stack, factor):
+	"""
+	Block mean of stack by factor along every axis, one block of slices at a time
+	so no float copy of the whole scan is made
+	"""
+	shape = [s // factor for s in stack.shape]
+	out = np.empty(shape, dtype='float32')
+	for z in range(shape[0]):
+		block = stack[z*factor:(z+1)*factor, :shape[1]*factor, :shape[2]*factor].mean(axis=0, dtype='float32')
+		out[z] = cv2.resize(block, (shape[2], shape[1]), interpolation=cv2.INTER_AREA)
+	return out
+
+
+class Localiser():
+	"""
+	Locate organs by FFT cross correlating max projections with a template
+
+	Based on this paper
+	Leydon, P., O'Connell, M., Green, D., & Curran, K. (2019).
+	Cross-correlation template matching for liver localisation in computed tomography.
+	IMVIP 2019: Irish Machine Vision & Image Processing, August 28-30.
+	doi:10.21427/8fgf-y086
+
+	Template projections and their spectra are computed once per projection size,
+	so correlating many fish only costs one forward and inverse fft per projection.
+	locate3d matches the template in 3d instead, coarse to fine on downsampled scans.
+
+	parameters
+	organ : organ template to read with read_label(organ, 0)
+	thresh : 8 bit threshold applied to projections
+	roiSize : size of template crop
+	sigma : gaussian smoothing of correlation maps
+	"""
+
+	def __init__(self, organ='Otoliths', thresh=100, roiSize=150, sigma=1, ctreader=None):
+		self.ctreader = ctreader if ctreader else CTreader()
+		self.organ = organ
+		self.thresh = thresh
+		self.roiSize = roiSize
+		self.sigma = sigma
+		template = self.ctreader.read_label(organ, 0)
+		template = self.ctreader.crop_around_center3d(template, roiSize=roiSize)
+		# flip so the fft product is a correlation
+		self.templates = [normalise(p)[::-1, ::-1] for p in self.ctreader.make_max_projections(template)]
+		# 3d matching only cares where bone is, not which otolith is which class
+		self.volume_template = (template > 0).astype('float32')
+		self.volume_templates = {}
+		self.spectra = {}
+		self.centres_path = self.ctreader.dataset_path / f'Metadata/cc_centres_{organ}.json'
+		self.confidence_path = self.ctreader.dataset_path / f'Metadata/cc_confidence_{organ}.json'
+
+	def spectrum(self, key, template, fshape):
+		"""
+		Cached fft of a template padded to fshape
+		"""
+		if (key, fshape) not in self.spectra:
+			self.spectra[(key, fshape)] = np.fft.rfftn(template, fshape)
+		return self.spectra[(key, fshape)]
+
+	def correlate(self, img, axis):
+		"""
+		'same' size cross correlation of a projection with template projection `axis`
+		"""
+		tpl = self.templates[axis]
+		fshape = tuple(next_fast_len(s + t - 1) for s, t in zip(img.shape, tpl.shape))
+		full = np.fft.irfft2(np.fft.rfft2(img, fshape) * self.spectrum(axis, tpl, fshape), fshape)
+		h, w = tpl.shape
+		y0, x0 = (h - 1) // 2, (w - 1) // 2
+		corr = full[y0:y0+img.shape[0], x0:x0+img.shape[1]]
+		if self.sigma: corr = cv2.GaussianBlur(corr, (0, 0), self.sigma)
+		return corr
+
+	def correlate3d(self, vol, key, tpl):
+		"""
+		'valid' cross correlation of a volume with a 3d template (already flipped)
+		corr[k] scores the template's corner at voxel k, so only lags where it fits inside vol are returned
+		"""
+		fshape = tuple(next_fast_len(s) for s in vol.shape)
+		circ = np.fft.irfftn(np.fft.rfftn(vol, fshape) * self.spectrum(key, tpl, fshape), fshape)
+		# lag k of a flipped template ends up at index k + template size - 1
+		z, x, y = (t - 1 for t in tpl.shape)
+		return circ[z:vol.shape[0], x:vol.shape[1], y:vol.shape[2]]
+
+	def template3d(self, factor):
+		"""
+		Flipped and normalised 3d template downsampled by factor
+		"""
+		if factor not in self.volume_templates:
+			tpl = downsample(self.volume_template, factor) if factor > 1 else self.volume_template
+			self.volume_templates[factor] = normalise(tpl)[::-1, ::-1, ::-1]
+		return self.volume_templates[factor]
+
+	def projections(self, n):
+		"""
+		Thresholded axial, (z, y) and (z, x) projections of fish n in make_max_projections order
+		"""
+		z, y, x = self.ctreader.read_max_projections(n)
+		# saved y_n.png is the max over y so (z, x) and x_n.png is (z, y), swapped from make_max_projections
+		projections = [z, x, y]
+		if any(p is None for p in projections):
+			# projections haven't been saved for this fish so make them
+			# saved projections are aligned so make these aligned too
+			ct, metadata = self.ctreader.read(n, align=True)
+			projections = [self.ctreader.to8bit(p) for p in self.ctreader.make_max_projections(ct)]
+		projections = [cv2.cvtColor(p, cv2.COLOR_BGR2GRAY) if p.ndim == 3 else p for p in projections]
+		return [normalise(self.ctreader.thresh_img(p, self.thresh, False)) for p in projections]
+
+	def locate(self, n):
+		"""
+		Find organ centre of fish n
+
+		returns [z, x, y] centre and dict with peak to sidelobe ratio of each projection,
+		pixel disagreement between projections and overall confidence (lowest ratio)
+		"""
+		peaks, psr = [], []
+		for axis, img in enumerate(self.projections(n)):
+			corr = self.correlate(img, axis)
+			peak = np.unravel_index(np.argmax(corr), corr.shape)
+			peaks.append(peak)
+			psr.append(peak_to_sidelobe(corr, peak))
+
+		# projections and templates are (x, y), (z, y) and (z, x)
+		(zx, zy), (yz, yy), (xz, xx) = peaks
+		center = [int((yz + xz) / 2), int((zx + xx) / 2), int((zy + yy) / 2)]
+		disagreement = int(max(abs(yz - xz), abs(zx - xx), abs(zy - yy)))
+		score = {
+			'psr'			: [round(p, 2) for p in psr],
+			'disagreement'	: disagreement,
+			'confidence'	: round(min(psr), 2),
+		}
+		return center, score
+
+	def locate3d(self, n, factor=4, window=None, align=True):
+		"""
+		Find organ centre of fish n by coarse to fine 3d template matching
+
+		The template is correlated with the scan downsampled by factor,
+		then the match is refined at full resolution in a window around the coarse position.
+		Unlike projections this keeps depth so left and right otoliths can't be swapped.
+
+		parameters
+		factor : downsampling of the coarse search, 4 or 8
+		window : voxels the full resolution search may move from the coarse match, defaults to 2 * factor
+		align : read the scan aligned with angles.json, centres in cc_centres are aligned
+
+		returns [z, x, y] centre and dict with peak to sidelobe ratio of the coarse search,
+		how far refinement moved the centre and overall confidence
+		"""
+		if window is None: window = 2 * factor
+		ct, metadata = self.ctreader.read(n, align=align)
+
+		coarse = downsample(ct, factor)
+		# threshold relative to the scan's range like to8bit then thresh_img would
+		lo, hi = coarse.min(), coarse.max()
+		cutoff = lo + (hi - lo) * self.thresh / 255
+		coarse[coarse < cutoff] = 0
+		tpl = self.template3d(factor)
+		corr = self.correlate3d(normalise(coarse), ('3d', factor), tpl)
+		if corr.size == 0: raise ValueError(f'[Localiser] fish {n} is smaller than the template')
+		peak = np.unravel_index(np.argmax(corr), corr.shape)
+		psr = peak_to_sidelobe(corr, peak, exclude=2)
+
+		# search the full resolution window, zero padded where it leaves the scan
+		size = np.array(self.volume_template.shape)
+		corner = np.array(peak) * factor - window
+		region = np.zeros(size + 2 * window, dtype='float32')
+		start = np.maximum(corner, 0)
+		stop = np.minimum(corner + region.shape, ct.shape)
+		src = ct[start[0]:stop[0], start[1]:stop[1], start[2]:stop[2]]
+		dst = start - corner
+		region[dst[0]:dst[0]+src.shape[0], dst[1]:dst[1]+src.shape[1], dst[2]:dst[2]+src.shape[2]] = src
+		region[region < cutoff] = 0
+		corr = self.correlate3d(normalise(region), ('3d', 1), self.template3d(1))
+		fine = np.unravel_index(np.argmax(corr), corr.shape)
+
+		center = [int(c) for c in corner + fine + size // 2]
+		coarse_center = np.array(peak) * factor + size // 2
+		score = {
+			'psr'			: round(psr, 2),
+			'refine_shift'	: int(np.abs(np.array(center) - coarse_center).max()),
+			'confidence'	: round(psr, 2),
+		}
+		return center, score
+
+	def locate_many(self, fish_list=None, overwrite=False, workers=4, mode='2d', factor=4):
+		"""
+		Locate every fish in fish_list and add them to cc_centres_<organ>.json
+		with their scores in cc_confidence_<organ>.json
+
+		parameters
+		fish_list : fish to locate, every fish in the dataset if None
+		overwrite : relocate fish that already have a centre
+		workers : threads correlating in parallel, each 3d worker holds a whole scan
+		mode : '2d' to match max projections or '3d' to match volumes with locate3d
+		factor : downsampling of the 3d coarse search
+
+		Fish that raise are left out of the centres and get a score of
+		{'error' : message, 'confidence' : 0} so they come up for checking by hand.
+
+		returns {fish : score} of the fish attempted
+		"""
+		if fish_list is None: fish_list = self.ctreader.fish_nums
+		centres = self.read_json(self.centres_path)
+		confidence = self.read_json(self.confidence_path)
+		todo = [n for n in fish_list if overwrite or str(n) not in centres]
+
+		if mode == '2d': locate = self.locate
+		elif mode == '3d': locate = lambda n : self.locate3d(n, factor, align=True)
+		else: raise ValueError(f'[Localiser] unknown mode {mode}')
+
+		def attempt(n):
+			# one bad scan shouldn't lose the rest of the run
+			try: return locate(n)
+			except Exception as e: return None, {'error' : repr(e), 'confidence' : 0}
+
+		located = {}
+		with ThreadPoolExecutor(workers) as pool:
+			for n, (center, score) in zip(todo, pool.map(attempt, todo)):
+				confidence[str(n)] = score
+				located[n] = score
+				if center is None:
+					print(f'[Localiser] fish {n} failed {score["error"]}')
+					continue
+				centres[str(n)] = center
+				print(f'[Localiser] fish {n} centre {center} confidence {score["confidence"]}')
+
+		self.write_json(self.centres_path, centres)
+		self.write_json(self.confidence_path, confidence)
+		return located
+
+	def read_json(self, path):
+		if not path.is_file(): return {}
+		with open(path, 'r') as fp:
+			return json.load(fp)
+
+	def write_json(self, path, data):
+		with open(path, 'w') as fp:
+			json.dump(data, fp, sort_keys=True, indent=4)
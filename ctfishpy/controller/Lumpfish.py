@@ -1,5 +1,3 @@
-from natsort import natsorted, ns
-from qtpy.QtCore import QSettings
 from pathlib2 import Path
 from tqdm import tqdm
 import tifffile as tiff
@@ -7,65 +5,45 @@ import pandas as pd
 import numpy as np 
 import json
 import cv2
-import os
 import gc
 import h5py
+from .ScanIndex import ScanIndex
 
 class Lumpfish():
     
     def __init__(self):
         self.mastersheet = pd.read_csv('./uCT_mastersheet.csv')
         self.fishnums = np.arange(40,639)
+        self.low_res_path = '../../Data/HDD/uCT/low_res/'
+        self.index = None
 
     def mastersheet(self):
         return pd.read_csv('./uCT_mastersheet.csv')
         #to count use master['age'].value_counts()
 
+    def list_scans(self):
+        '''
+        Refresh the raw scan index and return it
+        Only folders modified since the last call are rescanned
+        '''
+        if self.index is None: self.index = ScanIndex(self.low_res_path)
+        self.index.refresh()
+        self.files = self.index.names()
+        self.fish_order_nums = self.index.fish_nums()
+        return self.index
+
     def read_tiff(self, file_number = None, r = None, scale = 40):
-        path = '../../Data/HDD/uCT/low_res/'
-        
-        # find all dirty scan folders and save as csv in directory
-        files      = os.listdir(path)
-        files      = natsorted(files, alg=ns.IGNORECASE) #sort according to names without leading zeroes
-        files_df   = pd.DataFrame(files) #change to df to save as csv
-        files_df.to_csv('../../Data/HDD/uCT/filenames_low_res.csv', index = False, header = False)
-        fish_nums = []
-        for f in files:
-            nums = [int(i) for i in f.split('_') if i.isdigit()]
-            if len(nums) == 2:
-                start = nums[0]
-                end = nums[1]+1
-                nums = list(range(start, end))
-            else:
-                nums = [i for i in nums]
-            fish_nums.append(nums)
-        self.fish_order_nums = fish_nums#[[files[i], fish_nums[i]] for i in range(0, len(files))]
-        self.files = files
-
-        # get rid of weird mac files
-        for file in files:
-            if file.endswith('DS_Store'): files.remove(file)
+        index = self.list_scans()
 
         # if no file number was provided to read then print files list
         if file_number == None: 
-            print(files)
+            print(self.files)
             return
 
-        #f ind all dirs in scan folder
-        file = files[file_number]
-        for path, dirs, files in os.walk('../../Data/HDD/uCT/low_res/'+file+''):
-            dirs = sorted(dirs)
-            break
-
-        # Find tif folder and if it doesnt exist read images in main folder
-        tif = []
-        for i in dirs: 
-            if i.startswith('EK'):
-                tif.append(i)
-        if tif: tifpath = path+'/'+tif[0]+'/'
-        else: tifpath = path+'/'
-
-        tifpath = Path(tifpath)
+        scan = index[file_number]
+        file = scan['name']
+        path = scan['path']
+        tifpath = Path(scan['tif_dir'])
         files = sorted(tifpath.iterdir())
         images = [str(f) for f in files if f.suffix == '.tif']
 
@@ -87,19 +65,10 @@ class Lumpfish():
         if np.count_nonzero(ct) == 0:
             raise ValueError('Image is empty.')
 
-        # read xtekct
-        path = Path(path) # change str path to pathlib format
-        files = path.iterdir()
-        xtekctpath = [str(f) for f in files if f.suffix == '.xtekct'][0]
-
-        # check if xtekct exists
-        if not Path(xtekctpath).is_file():
+        # voxel sizes come from the xtekct file, parsed once by the scan index
+        if scan['xtekct'] is None:
             raise Exception("[CTFishPy] XtekCT file not found. ")
-        
-        xtekct = QSettings(xtekctpath, QSettings.IniFormat)
-        x_voxelsize = xtekct.value('XTekCT/VoxelSizeX')
-        y_voxelsize = xtekct.value('XTekCT/VoxelSizeY')
-        z_voxelsize = xtekct.value('XTekCT/VoxelSizeZ')
+        x_voxelsize, y_voxelsize, z_voxelsize = scan['voxel_size']
 
         metadata = {'path': str(path), 
                     'scale' : scale,
@@ -111,50 +80,18 @@ class Lumpfish():
 
     def read_dirty(self, file_number = None, r = None, 
         scale = 40):
-        path = '../../Data/HDD/uCT/low_res/'
-        
-        # find all dirty scan folders and save as csv in directory
-        files      = os.listdir(path)
-        files      = natsorted(files, alg=ns.IGNORECASE) #sort according to names without leading zeroes
-        files_df    = pd.DataFrame(files) #change to df to save as csv
-        files_df.to_csv('../../Data/HDD/uCT/filenames_low_res.csv', index = False, header = False)
-        
-        fish_nums = []
-        for f in files:
-            nums = [int(i) for i in f.split('_') if i.isdigit()]
-            if len(nums) == 2:
-                start = nums[0]
-                end = nums[1]+1
-                nums = list(range(start, end))
-            fish_nums.append(nums)
-        self.fish_order_nums = fish_nums#[[files[i], fish_nums[i]] for i in range(0, len(files))]
-        self.files = files
-
-        # get rid of weird mac files
-        for file in files:
-            if file.endswith('DS_Store'): files.remove(file)
+        index = self.list_scans()
 
         # if no file number was provided to read then print files list
         if file_number == None: 
-            print(files)
+            print(self.files)
             return
 
-        #f ind all dirs in scan folder
-        file = files[file_number]
-        for path, dirs, files in os.walk('../../Data/HDD/uCT/low_res/'+file+''):
-            dirs = sorted(dirs)
-            break
-
-        # Find tif folder and if it doesnt exist read images in main folder
-        tif = []
-        for i in dirs: 
-            if i.startswith('EK'):
-                tif.append(i)
-        if tif: tifpath = path+'/'+tif[0]+'/'
-        else: tifpath = path+'/'
-
+        scan = index[file_number]
+        file = scan['name']
+        path = scan['path']
+        tifpath = Path(scan['tif_dir'])
         print('tifpath:', tifpath)
-        tifpath = Path(tifpath)
         files = sorted(tifpath.iterdir())
         images = [str(f) for f in files if f.suffix == '.tif']
 
@@ -184,19 +121,10 @@ class Lumpfish():
         if np.count_nonzero(ct) == 0:
             raise ValueError('Image is empty.')
 
-        # read xtekct
-        path = Path(path) # change str path to pathlib format
-        files = path.iterdir()
-        xtekctpath = [str(f) for f in files if f.suffix == '.xtekct'][0]
-
-        # check if xtekct exists
-        if not Path(xtekctpath).is_file():
+        # voxel sizes come from the xtekct file, parsed once by the scan index
+        if scan['xtekct'] is None:
             raise Exception("[CTFishPy] XtekCT file not found. ")
-        
-        xtekct = QSettings(xtekctpath, QSettings.IniFormat)
-        x_voxelsize = xtekct.value('XTekCT/VoxelSizeX')
-        y_voxelsize = xtekct.value('XTekCT/VoxelSizeY')
-        z_voxelsize = xtekct.value('XTekCT/VoxelSizeZ')
+        x_voxelsize, y_voxelsize, z_voxelsize = scan['voxel_size']
 
         metadata = {'path': str(path), 
                     'scale' : scale,
@@ -322,9 +250,7 @@ class Lumpfish():
             json.dump(crop_data, o)
 
     def readCrop(self, number):
-        files = pd.read_csv('../../Data/HDD/uCT/filenames_low_res.csv', header = None)
-        files = files.values.tolist()
-        crop_path = '../../Data/HDD/uCT/low_res/'+files[number][0]+'/crop_data.json'
+        crop_path = self.list_scans()[number]['path']+'/crop_data.json'
         with open(crop_path) as f:
             crop_data = json.load(f)
         return crop_data
@@ -0,0 +1,104 @@
+from pathlib2 import Path
+import pandas as pd
+import numpy as np
+import h5py
+
+
+class MasterIndex():
+	"""
+	Prebuilt index over the mastersheet for selecting cohorts of fish
+
+	Every categorical column is stored as one boolean bitmap per value,
+	so a query is a handful of vectorised ORs and ANDs over arrays the length of the sheet.
+	Which fish have labels or predictions is read from the label stores once and cached,
+	call refresh() after writing to them.
+
+	parameters
+	master : mastersheet DataFrame from CTreader.mastersheet()
+	dataset_path : dataset holding Labels/Organs/, needed for has_label and has_prediction
+	scanned : fish numbers with scans on disk, e.g. CTreader.fish_nums
+	"""
+
+	CATEGORICAL = ['genotype', 'strain', 'name']
+
+	def __init__(self, master, dataset_path=None, scanned=None):
+		self.master = master
+		self.dataset_path = Path(dataset_path) if dataset_path else None
+		self.n = master['n'].to_numpy(dtype='int64')
+		self.age = pd.to_numeric(master['age'], errors='coerce').to_numpy(dtype='float64')
+		self.scanned = np.isin(self.n, list(scanned)) if scanned is not None else None
+		self.bitmaps = {col : self.build_bitmaps(col) for col in self.CATEGORICAL if col in master}
+		self.stores = {}
+
+	def build_bitmaps(self, col):
+		cat = pd.Categorical(self.master[col])
+		return {value : cat.codes == i for i, value in enumerate(cat.categories)}
+
+	def select(self, col, values):
+		"""
+		Mask of fish whose col is any of values
+		"""
+		if col not in self.bitmaps: self.bitmaps[col] = self.build_bitmaps(col)
+		if isinstance(values, (str, int, float)): values = [values]
+		mask = np.zeros(len(self.n), dtype=bool)
+		for value in values:
+			bitmap = self.bitmaps[col].get(value)
+			if bitmap is not None: mask |= bitmap
+		return mask
+
+	def select_age(self, age):
+		"""
+		Mask of fish of age, a value, an inclusive (min, max) range or a set of ages
+		"""
+		if isinstance(age, tuple):
+			lo, hi = age
+			mask = np.ones(len(self.n), dtype=bool)
+			if lo is not None: mask &= self.age >= lo
+			if hi is not None: mask &= self.age <= hi
+			return mask
+		if isinstance(age, (list, set, frozenset)): return np.isin(self.age, list(age))
+		return self.age == age
+
+	def store(self, name):
+		"""
+		Mask of fish stored in Labels/Organs/<name>/<name>.h5
+		"""
+		if name not in self.stores:
+			if self.dataset_path is None: raise ValueError('[MasterIndex] dataset_path is needed to query labels')
+			path = self.dataset_path / f'Labels/Organs/{name}/{name}.h5'
+			keys = []
+			if path.is_file():
+				with h5py.File(str(path), 'r') as f:
+					keys = [int(k) for k in f.keys()]
+			self.stores[name] = np.isin(self.n, keys)
+		return self.stores[name]
+
+	def refresh(self):
+		self.stores = {}
+
+	def query(self, age=None, genotype=None, strain=None, has_label=None, has_prediction=None, scanned=None, **columns):
+		"""
+		Fish numbers matching every predicate given
+
+		parameters
+		age : value, inclusive (min, max) range with None for open ends, or set of ages
+		genotype, strain : value or set of values, any other column can be given the same way
+		has_label : organ that must be labelled
+		has_prediction : organ that must be predicted into the default <organ>-unet store,
+			use has_label with the store name for other PredictionJob stores
+		scanned : True for fish with scans on disk, False for fish without
+
+		returns np array of fish numbers
+		"""
+		mask = np.ones(len(self.n), dtype=bool)
+		if age is not None: mask &= self.select_age(age)
+		if genotype is not None: mask &= self.select('genotype', genotype)
+		if strain is not None: mask &= self.select('strain', strain)
+		for col, values in columns.items():
+			mask &= self.select(col, values)
+		if has_label is not None: mask &= self.store(has_label)
+		if has_prediction is not None: mask &= self.store(f'{has_prediction}-unet')
+		if scanned is not None:
+			if self.scanned is None: raise ValueError('[MasterIndex] scanned fish were not given')
+			mask &= self.scanned if scanned else ~self.scanned
+		return self.n[mask]
@@ -0,0 +1,166 @@
+from natsort import natsorted, ns
+from pathlib2 import Path
+import json
+import os
+
+
+def read_xtekct(path):
+	"""
+	Read an XtekCT .xtekct file into a dictionary without needing Qt
+	These are plain INI files so a small parser is enough
+
+	parameters
+	path : path to .xtekct file
+
+	returns {section : {key : value}} with values as strings
+	"""
+	settings = {}
+	section = settings.setdefault('General', {})
+	with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+		for line in f:
+			line = line.strip()
+			if not line or line[0] in ';#': continue
+			if line.startswith('[') and line.endswith(']'):
+				section = settings.setdefault(line[1:-1].strip(), {})
+				continue
+			if '=' not in line: continue
+			key, value = line.split('=', 1)
+			section[key.strip()] = value.strip().strip('"')
+	return settings
+
+
+def read_voxel_size(path):
+	"""
+	Return [x, y, z] voxel sizes from an XtekCT file, None where missing
+	"""
+	xtekct = read_xtekct(path).get('XTekCT', {})
+	voxel_size = []
+	for axis in ['X', 'Y', 'Z']:
+		value = xtekct.get(f'VoxelSize{axis}')
+		try:
+			voxel_size.append(float(value))
+		except (TypeError, ValueError):
+			voxel_size.append(None)
+	return voxel_size
+
+
+def parse_fish_nums(name):
+	"""
+	Find fish numbers in a raw scan folder name
+	e.g. 'EK_208_215' -> [208, 209, ... 215]
+	"""
+	nums = [int(i) for i in name.split('_') if i.isdigit()]
+	if len(nums) == 2:
+		nums = list(range(nums[0], nums[1]+1))
+	return nums
+
+
+class ScanIndex():
+	"""
+	Persistent index of raw multi-fish scan folders
+
+	Each folder is stored with its fish numbers, tif directory, slice count and voxel size.
+	The index is saved as json next to the scan folder and only folders that
+	changed since the last refresh (by mtime) are rescanned.
+	"""
+
+	def __init__(self, path='../../Data/HDD/uCT/low_res/', index_path=None):
+		self.path = Path(path)
+		if index_path is None: index_path = self.path.parent / 'low_res_index.json'
+		self.index_path = Path(index_path)
+		self.csv_path = self.path.parent / 'filenames_low_res.csv'
+		self.entries = {}
+		self.load()
+
+	def load(self):
+		if self.index_path.is_file():
+			with open(self.index_path, 'r') as fp:
+				self.entries = json.load(fp)
+
+	def save(self):
+		with open(self.index_path, 'w') as fp:
+			json.dump(self.entries, fp, sort_keys=True, indent=4)
+		# keep filenames csv for old scripts that index scans by row
+		with open(self.csv_path, 'w') as fp:
+			fp.writelines(f'{name}\n' for name in self.names())
+
+	def refresh(self):
+		"""
+		Rescan folders that were added or modified since last refresh
+		Returns True if the index changed
+		"""
+		changed = False
+		found = {}
+		with os.scandir(self.path) as it:
+			for d in it:
+				if d.is_dir(): found[d.name] = d.stat().st_mtime
+
+		for name in list(self.entries.keys()):
+			if name not in found:
+				del self.entries[name]
+				changed = True
+
+		for name, mtime in found.items():
+			entry = self.entries.get(name)
+			if entry is not None and entry['mtime'] == mtime and self._tif_mtime(entry) == entry['tif_mtime']:
+				continue
+			self.entries[name] = self._scan_folder(name, mtime)
+			changed = True
+
+		if changed: self.save()
+		return changed
+
+	def _tif_mtime(self, entry):
+		try:
+			return os.stat(entry['tif_dir']).st_mtime
+		except OSError:
+			return None
+
+	def _scan_folder(self, name, mtime):
+		folder = self.path / name
+		dirs, xtekct = [], None
+		with os.scandir(folder) as it:
+			for d in it:
+				if d.is_dir(): dirs.append(d.name)
+				elif d.name.endswith('.xtekct') and xtekct is None: xtekct = d.path
+
+		# Find tif folder and if it doesnt exist read images in main folder
+		tif = [d for d in sorted(dirs) if d.startswith('EK')]
+		tif_dir = folder / tif[0] if tif else folder
+		with os.scandir(tif_dir) as it:
+			n_slices = sum(1 for f in it if f.name.endswith('.tif'))
+
+		entry = {
+			'name'       : name,
+			'path'       : str(folder),
+			'fish_nums'  : parse_fish_nums(name),
+			'tif_dir'    : str(tif_dir),
+			'n_slices'   : n_slices,
+			'xtekct'     : xtekct,
+			'voxel_size' : read_voxel_size(xtekct) if xtekct else [None, None, None],
+			'mtime'      : mtime,
+		}
+		entry['tif_mtime'] = self._tif_mtime(entry)
+		return entry
+
+	def names(self):
+		# sort according to names without leading zeroes
+		return natsorted(self.entries.keys(), alg=ns.IGNORECASE)
+
+	def fish_nums(self):
+		return [self.entries[name]['fish_nums'] for name in self.names()]
+
+	def __len__(self):
+		return len(self.entries)
+
+	def __getitem__(self, file_number):
+		return self.entries[self.names()[file_number]]
+
+	def find(self, fish):
+		"""
+		Return the entry of the scan folder that contains fish number
+		"""
+		for name in self.names():
+			if fish in self.entries[name]['fish_nums']:
+				return self.entries[name]
+		raise KeyError(f'[CTFishPy] Fish {fish} not found in scan index')
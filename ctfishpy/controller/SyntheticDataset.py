@@ -0,0 +1,231 @@
+from pathlib2 import Path
+import tifffile as tiff
+import pandas as pd
+import numpy as np
+import json
+import cv2
+import h5py
+
+GENOTYPES = ['wt', 'het', 'hom']
+STRAINS = ['ab', 'tl', 'wik']
+AGES = [3, 6, 12, 24, 36]
+
+
+class SyntheticDataset():
+	"""
+	Build a fake dataset with the same layout as DATASET_PATH so readers and models
+	can be benchmarked and tested anywhere
+
+	Every fish is a tube phantom holding a tapered body with a spine, a dorsal fin
+	and pairs of otolith-like blobs near the head, rotated by a random alignment angle.
+	Slices are generated and written one at a time so big scans don't need to fit in memory.
+
+	Writes
+	low_res_clean/<fish>/reconstructed_tifs/*.tif and metadata.json
+	Metadata/angles.json and Metadata/cc_centres_<organ>.json (aligned [z, x, y] of the otoliths)
+	Labels/Organs/<organ>/<organ>.h5 for a fraction of fish and Labels/Templates/<organ>.h5
+	projections/{z,y,x}/ max projections of the aligned scans, like Archive/make_projections.py
+		z_n.png is (x, y), y_n.png the max over y so (z, x) and x_n.png the max over x so (z, y)
+	uCT_mastersheet.csv, which CTreader reads from the working directory not the dataset,
+	so run from the dataset folder or copy it there to query the synthetic fish
+
+	parameters
+	path : folder to create the dataset in, point DATASET_PATH at it
+	fish_nums : fish numbers to make
+	shape : (z, x, y) of each scan
+	nclasses : otolith classes, each a left and right blob
+	labelled : fraction of fish with labels
+	template_size : side of the template cube cropped around the otoliths of the first fish
+	seed : everything generated is reproducible from this
+	"""
+
+	def __init__(self, path, fish_nums=range(1, 9), shape=(200, 256, 256), organ='Otoliths', nclasses=2,
+				labelled=0.75, template_size=None, seed=0):
+		self.path = Path(path)
+		self.fish_nums = list(fish_nums)
+		self.shape = tuple(shape)
+		self.organ = organ
+		self.nclasses = nclasses
+		self.labelled = labelled
+		self.template_size = template_size if template_size else 2 * (min(shape) // 4)
+		self.seed = seed
+
+	def design(self, rng):
+		"""
+		Random geometry of one fish in aligned coordinates, fractions of the scan size
+		"""
+		z, x, y = self.shape
+		head = rng.uniform(0.2, 0.3) * z
+		cx, cy = x / 2 + rng.normal(0, 0.02) * x, y / 2 + rng.normal(0, 0.02) * y
+		blobs = []
+		for c in range(self.nclasses):
+			# each class is a left and right blob further back and smaller than the last
+			bz = head + c * 0.06 * z
+			radius = np.array([0.04 * z, 0.035 * x, 0.03 * y]) * (1 - 0.25 * c) * rng.uniform(0.9, 1.1)
+			for side in [-1, 1]:
+				blobs.append((c + 1, np.array([bz, cx, cy + side * 0.07 * y]), radius))
+		return {
+			'angle'			: float(round(rng.uniform(0, 360), 1)),
+			'body'			: (cx, cy, 0.28 * x * rng.uniform(0.9, 1.1), 0.14 * y * rng.uniform(0.9, 1.1)),
+			'extent'		: (0.05 * z, 0.95 * z),
+			'spine'			: (cx - 0.1 * x, cy, 0.025 * x),
+			'fin'			: (0.4 * z, 0.7 * z),
+			'blobs'			: blobs,
+			'intensity'		: rng.uniform(0.9, 1.1),
+		}
+
+	def aligned_slice(self, z, design, rows, cols, rng):
+		"""
+		uint16 ct and uint8 label of aligned slice z
+		"""
+		x, y = self.shape[1:]
+		ct = rng.normal(2000, 600, (x, y)).astype('float32')
+		label = np.zeros((x, y), dtype='uint8')
+
+		# tube phantom wall
+		r = np.hypot(rows - x / 2, cols - y / 2)
+		tube = 0.46 * min(x, y)
+		ct[(r > tube) & (r < tube + 3)] += 12000
+
+		cx, cy, a, b = design['body']
+		z0, z1 = design['extent']
+		if z0 <= z <= z1:
+			# body tapers towards the tail
+			taper = 1 - 0.6 * (z - z0) / (z1 - z0)
+			body = ((rows - cx) / (a * taper)) ** 2 + ((cols - cy) / (b * taper)) ** 2 <= 1
+			ct[body] += 6000 * design['intensity']
+			sx, sy, sr = design['spine']
+			ct[np.hypot(rows - sx, cols - sy) <= sr * taper] += 20000
+			f0, f1 = design['fin']
+			if f0 <= z <= f1:
+				fin = (np.abs(cols - cy) <= 0.01 * y + 1) & (rows < cx - a * taper + 1) & (rows > cx - a * taper - 0.1 * x)
+				ct[fin] += 5000
+
+		for c, centre, radius in design['blobs']:
+			dz = (z - centre[0]) / radius[0]
+			if abs(dz) >= 1: continue
+			shrink = np.sqrt(1 - dz ** 2)
+			blob = ((rows - centre[1]) / (radius[1] * shrink)) ** 2 + ((cols - centre[2]) / (radius[2] * shrink)) ** 2 <= 1
+			ct[blob] = 45000 * design['intensity'] + rng.normal(0, 1500, int(blob.sum()))
+			label[blob] = c
+
+		return np.clip(ct, 0, 65535).astype('uint16'), label
+
+	def centre(self, design):
+		# aligned [z, x, y] in the middle of all otoliths
+		return [int(round(v)) for v in np.mean([centre for c, centre, radius in design['blobs']], axis=0)]
+
+	def rotate(self, image, angle, interpolation):
+		# the inverse of CTreader.rotate_image so read(align=True) undoes it
+		centre = tuple(np.array(image.shape[1::-1]) / 2)
+		rot_mat = cv2.getRotationMatrix2D(centre, -angle, 1.0)
+		return cv2.warpAffine(image, rot_mat, image.shape[1::-1], flags=interpolation)
+
+	def make_fish(self, n, design, rng, labels=None):
+		"""
+		Write the tiffs and metadata of fish n, and its label to the open h5 file labels
+		returns its aligned max projections
+		"""
+		depth, x, y = self.shape
+		fishpath = self.path / 'low_res_clean' / str(n).zfill(3)
+		tifpath = fishpath / 'reconstructed_tifs'
+		tifpath.mkdir(parents=True, exist_ok=True)
+		rows, cols = np.mgrid[0:x, 0:y].astype('float32')
+
+		dset = None
+		if labels is not None:
+			if str(n) in labels: del labels[str(n)]
+			dset = labels.create_dataset(str(n), shape=self.shape, dtype='uint8', compression=1)
+
+		# z, y and x projections in the saved order, see the class docstring
+		projections = [np.zeros((x, y), 'uint16'), np.zeros((depth, x), 'uint16'), np.zeros((depth, y), 'uint16')]
+		for z in range(depth):
+			ct, label = self.aligned_slice(z, design, rows, cols, rng)
+			# projections are saved aligned so they come from the slice before it is rotated
+			np.maximum(projections[0], ct, out=projections[0])
+			projections[1][z] = ct.max(axis=1)
+			projections[2][z] = ct.max(axis=0)
+			ct = self.rotate(ct, design['angle'], cv2.INTER_LINEAR)
+			tiff.imwrite(str(tifpath / f'{str(n).zfill(3)}_{str(z).zfill(4)}.tif'), ct)
+			if dset is not None: dset[z] = self.rotate(label, design['angle'], cv2.INTER_NEAREST)
+
+		metadata = {
+			'N'				: n,
+			'Skip'			: None,
+			'Age'			: None,
+			'Genotype'		: None,
+			'Strain'		: None,
+			'Name'			: 'synthetic',
+			'VoxelSizeX'	: 0.0202,
+			'VoxelSizeY'	: 0.0202,
+			'VoxelSizeZ'	: 0.0202,
+			'angle'			: design['angle'],
+		}
+		with open(fishpath / 'metadata.json', 'w') as f:
+			json.dump(metadata, f, indent=4)
+		return projections
+
+	def make_template(self, design):
+		"""
+		Aligned label cube around the otoliths, unlike fish labels templates aren't rotated
+		"""
+		size = self.template_size
+		template = np.zeros((size, size, size), dtype='uint8')
+		rows, cols = np.mgrid[0:self.shape[1], 0:self.shape[2]].astype('float32')
+		quiet = np.random.default_rng(0)
+		z0, x0, y0 = (c - size // 2 for c in self.centre(design))
+		for i in range(size):
+			z = z0 + i
+			if not 0 <= z < self.shape[0]: continue
+			ct, label = self.aligned_slice(z, design, rows, cols, quiet)
+			# copy the part of the slice that falls inside the cube
+			xs, ys = slice(max(x0, 0), x0 + size), slice(max(y0, 0), y0 + size)
+			crop = label[xs, ys]
+			template[i, xs.start - x0:xs.start - x0 + crop.shape[0], ys.start - y0:ys.start - y0 + crop.shape[1]] = crop
+		return template
+
+	def generate(self):
+		"""
+		Write the whole dataset, returns {fish : design}
+		"""
+		rng = np.random.default_rng(self.seed)
+		designs = {n : self.design(rng) for n in self.fish_nums}
+		n_labelled = int(round(self.labelled * len(self.fish_nums)))
+		labelled = set(self.fish_nums[:n_labelled])
+
+		for folder in ['Metadata', f'Labels/Organs/{self.organ}', 'Labels/Templates', 'projections/z', 'projections/y', 'projections/x']:
+			(self.path / folder).mkdir(parents=True, exist_ok=True)
+
+		with h5py.File(str(self.path / f'Labels/Organs/{self.organ}/{self.organ}.h5'), 'a') as labels:
+			for n in self.fish_nums:
+				print(f'[SyntheticDataset] making fish {n}')
+				fish_rng = np.random.default_rng([self.seed, n])
+				projections = self.make_fish(n, designs[n], fish_rng, labels if n in labelled else None)
+				for axis, projection in zip(['z', 'y', 'x'], projections):
+					projection = ((projection - projection.min()) / (max(int(projection.max()) - int(projection.min()), 1) / 255)).astype('uint8')
+					cv2.imwrite(str(self.path / f'projections/{axis}/{axis}_{n}.png'), projection)
+
+		with h5py.File(str(self.path / f'Labels/Templates/{self.organ}.h5'), 'w') as f:
+			f.create_dataset('0', data=self.make_template(designs[self.fish_nums[0]]), compression=1)
+
+		angles = {str(n) : d['angle'] for n, d in designs.items()}
+		centres = {str(n) : self.centre(d) for n, d in designs.items()}
+		with open(self.path / 'Metadata/angles.json', 'w') as f:
+			json.dump(angles, f)
+		with open(self.path / f'Metadata/cc_centres_{self.organ}.json', 'w') as f:
+			json.dump(centres, f, sort_keys=True, indent=4)
+		# older readers still look for this at the top of the dataset
+		with open(self.path / f'cc_centres_{self.organ.lower()}.json', 'w') as f:
+			json.dump(centres, f, sort_keys=True, indent=4)
+
+		master = pd.DataFrame({
+			'n'			: self.fish_nums,
+			'age'		: rng.choice(AGES, len(self.fish_nums)),
+			'genotype'	: rng.choice(GENOTYPES, len(self.fish_nums)),
+			'strain'	: rng.choice(STRAINS, len(self.fish_nums)),
+			'name'		: 'synthetic',
+		})
+		master.to_csv(self.path / 'uCT_mastersheet.csv', index=False)
+		print(f'[SyntheticDataset] wrote {len(self.fish_nums)} fish to {self.path}, set DATASET_PATH={self.path}')
+		print(f'[SyntheticDataset] CTreader reads ./uCT_mastersheet.csv, run from {self.path} to use its mastersheet')
+		return designs
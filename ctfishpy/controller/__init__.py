@@ -1,2 +1,7 @@
 from .CTreader import *
 from .Lumpfish import *
+from .ScanIndex import *
+from .Localiser import *
+from .Aligner import *
+from .MasterIndex import *
+from .SyntheticDataset import *
\ No newline at end of file
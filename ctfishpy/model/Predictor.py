@@ -0,0 +1,123 @@
+from ..controller import CTreader
+from .tiling import predict_tiled
+from .postprocess import probs_to_label, keep_largest_components
+from .export import load_exported
+import numpy as np
+import json
+
+
+class Predictor():
+	"""
+	Segment many fish with one loaded model
+
+	The model is built, loaded and warmed up with a dummy batch once,
+	and the CTreader, cc centres and angles are kept so repeated predictions only pay for inference.
+	Prediction is split into read, preprocess and infer so they can also run as pipeline stages.
+
+	parameters
+	unet : Unet with the settings and weightspath to predict with
+	warmup : run a dummy batch so the first real prediction isn't slowed by graph tracing
+	artifact : path of a model from export_model to run instead of the keras checkpoint
+	threads : cpu threads for tflite and onnx artifacts
+	"""
+
+	def __init__(self, unet, warmup=True, artifact=None, threads=None):
+		self.unet = unet
+		self.ctreader = CTreader()
+		if artifact is None: artifact = unet.exportpath
+		if artifact: self.model = load_exported(artifact, threads)
+		else: self.model = unet.loadModel()
+		self._centres = None
+		self._angles = None
+		if warmup:
+			dummy = np.zeros((unet.batch_size, unet.shape[0], unet.shape[1], 1), dtype='float32')
+			self.model.predict_on_batch(dummy)
+
+	@property
+	def centres(self):
+		if self._centres is None:
+			centres_path = self.ctreader.dataset_path / f'Metadata/cc_centres_{self.unet.organ}.json'
+			with open(centres_path, 'r') as fp:
+				self._centres = json.load(fp)
+		return self._centres
+
+	@property
+	def angles(self):
+		if self._angles is None:
+			with open(self.ctreader.anglePath, 'r') as fp:
+				self._angles = json.load(fp)
+		return self._angles
+
+	def read(self, n, tiled=False):
+		"""
+		Read the unaligned slices needed to segment fish n
+		"""
+		if tiled:
+			ct, stack_metadata = self.ctreader.read(n)
+			return ct
+		roiZ = self.unet.roiZ
+		z_center = self.centres[str(n)][0]
+		ct, stack_metadata = self.ctreader.read(n, r = (z_center - int(roiZ/2), z_center + int(roiZ/2)))
+		return ct
+
+	def preprocess(self, n, ct, tiled=False):
+		"""
+		Align slices from read, then crop and normalise them into model input for ROI prediction
+		"""
+		angle = self.angles[str(n)]
+		for i in range(len(ct)):
+			ct[i] = self.ctreader.rotate_image(ct[i], angle)
+		if tiled: return ct
+
+		unet = self.unet
+		center = self.centres[str(n)]
+		center = [int(unet.roiZ/2), center[1], center[2]]
+		ct = self.ctreader.crop_around_center3d(ct, center = center, roiSize=unet.shape[0], roiZ=unet.roiZ)
+		ct = ct.astype('float32') / 65535 # Normalise 16 bit slices
+		return ct[:,:,:,np.newaxis]
+
+	def infer(self, x, tiled=False, clean=False):
+		"""
+		Segment preprocessed input, returns uint8 label
+		"""
+		unet = self.unet
+		if tiled:
+			label = self.predict_scan(x)
+		else:
+			results = self.model.predict(x, unet.batch_size)
+			label = probs_to_label(results, unet.confidence_thresh)
+
+		if clean: keep_largest_components(label, range(1, unet.nclasses))
+		return label
+
+	def predict(self, n, tiled=False, clean=False):
+		"""
+		Segment fish n, see Unet.predict
+		"""
+		ct = self.read(n, tiled)
+		x = self.preprocess(n, ct, tiled)
+		return self.infer(x, tiled, clean)
+
+	def predict_scan(self, ct):
+		"""
+		Sliding window prediction of a whole uint16 scan, returns uint8 label
+		"""
+		unet = self.unet
+		blank_thresh = unet.tile_blank_thresh * (65535 / 255)
+		predict = lambda tiles : self.model.predict_on_batch(tiles)
+
+		label = np.zeros(ct.shape, dtype='uint8')
+		for z0, results in predict_tiled(predict, ct, unet.nclasses, tile=unet.shape, overlap=unet.tile_overlap,
+					batch_size=unet.batch_size, blank_thresh=blank_thresh, chunk=unet.tile_chunk):
+			probs_to_label(results, unet.confidence_thresh, out=label[z0:z0+len(results)])
+		return label
+
+	def predict_many(self, fish_list, tiled=False, clean=False):
+		"""
+		Segment every fish in fish_list
+		This is a generator so only one label is held at a time
+
+		yields (n, label)
+		"""
+		for n in fish_list:
+			yield n, self.predict(n, tiled=tiled, clean=clean)
@@ -1,4 +1,8 @@
 from ..controller import CTreader
+from .dataStream import DataStream, onehot
+from .losses import SparseDiceLoss, SparseCategoricalFocalLoss
+from .Predictor import Predictor
+from .callbacks import ThroughputLogger
 import matplotlib.pyplot as plt
 import numpy as np
 import time
@@ -19,23 +23,39 @@ class Unet():
 		self.organ = 'Otoliths'
 		self.sample = [200,218,240,277,330,337,341,462,464,40]
 		self.val_sample = [78, 364]
-		self.val_steps = 8
+		self.val_steps = None # None runs through every batch of the streams
 		self.batch_size = 64
-		self.steps_per_epoch = 34
+		self.steps_per_epoch = None # None runs through every batch of the stream
+		self.workers = 4 # parallel augmentation workers
+		self.max_queue_size = 8 # batches prefetched ahead of the model
+		self.fish_cache = 2 # fish ROIs each worker keeps in memory
+		self.foreground_fraction = 0.5 # fraction of training slices that contain otoliths
+		self.cache_rois = True # keep prepared ROIs as npy shards under dataset_path/Cache/rois
 		self.epochs = 100
 		self.lr = 1e-5
 		self.BACKBONE = 'resnet34'
 		self.weights = 'imagenet'
 		self.weightspath = 'output/Model/unet_checkpoints.hdf5'
+		self.exportpath = None # exported model to predict with instead, see export_model
 		# 'output/Model/unet_checkpoints.hdf5'
 		self.encoder_freeze=True
 		self.nclasses = 3
 		self.activation = 'softmax'
+		self.sparse = True # train on uint8 integer labels instead of one hot
+		self.tile_overlap = 0.5 # fraction of overlap between tiles for whole scan prediction
+		self.tile_blank_thresh = 50 # 8 bit max intensity below which tiles are skipped
+		self.tile_chunk = 16 # slices predicted together in whole scan prediction
+		self.confidence_thresh = 0.5 # voxels less confident than this are background
+		self.predictor = None # built on first predict and reused
 
 	def getModel(self):
 
-		dice_loss = sm.losses.DiceLoss(class_weights=np.array([1,5,5])) 
-		focal_loss = sm.losses.CategoricalFocalLoss()
+		if self.sparse:
+			dice_loss = SparseDiceLoss(self.nclasses, class_weights=np.array([1,5,5]))
+			focal_loss = SparseCategoricalFocalLoss(self.nclasses)
+		else:
+			dice_loss = sm.losses.DiceLoss(class_weights=np.array([1,5,5])) 
+			focal_loss = sm.losses.CategoricalFocalLoss()
 		total_loss = dice_loss + (1 * focal_loss)
 
 		optimizer = Adam(learning_rate=self.lr)
@@ -61,25 +81,33 @@ class Unet():
                     fill_mode='constant',
                     cval = 0)
 
-		xtrain, ytrain, sample_weights = self.dataGenie(batch_size=self.batch_size,
-                        data_gen_args = data_gen_args,
-                        fish_nums = self.sample)
-
-		xval, yval, sample_weights = self.dataGenie(batch_size = self.batch_size,
-				data_gen_args = dict(),
-				fish_nums = self.val_sample)
+		train_stream = DataStream(self.sample, self.batch_size, data_gen_args, organ=self.organ,
+						roiZ=self.roiZ, shape=self.shape, nclasses=self.nclasses, fish_cache=self.fish_cache, sparse=self.sparse,
+						foreground_fraction=self.foreground_fraction, cache=self.cache_rois,
+						timing_log=f'output/Model/loss_curves/{self.trainstarttime}_batches.csv')
+		val_stream = DataStream(self.val_sample, self.batch_size, dict(), organ=self.organ,
+						roiZ=self.roiZ, shape=self.shape, nclasses=self.nclasses, shuffle=False, fish_cache=self.fish_cache, sparse=self.sparse,
+						cache=self.cache_rois)
+		train_stream.prepare()
+		val_stream.prepare()
 		model = self.getModel()
 
 		model_checkpoint = ModelCheckpoint(self.weightspath, monitor = 'loss', verbose = 1, save_best_only = True)
 
 
+		throughput = ThroughputLogger(f'output/Model/loss_curves/{self.trainstarttime}_throughput.csv',
+						self.batch_size, timing_log=train_stream.timing_log, workers=self.workers)
+
 		callbacks = [
 			keras.callbacks.LearningRateScheduler(lr_scheduler, verbose=1),
-			model_checkpoint
+			model_checkpoint,
+			throughput
 		]
-		
-		history = model.fit(xtrain, y=ytrain, validation_data=(xval, yval), steps_per_epoch = self.steps_per_epoch, 
-                    	epochs = self.epochs, callbacks=callbacks, validation_steps=self.val_steps)
+
+		# DataStream orders its own batches so keras mustn't shuffle them
+		history = model.fit(train_stream, validation_data=val_stream, steps_per_epoch = self.steps_per_epoch, 
+                    	epochs = self.epochs, callbacks=callbacks, validation_steps=self.val_steps, shuffle=False,
+						workers=self.workers, use_multiprocessing=True, max_queue_size=self.max_queue_size)
 		self.history = history
 
 	def makeLossCurve(self):
@@ -97,23 +125,31 @@ class Unet():
 		# TODO setup proper end test
 		pass
 
-	def predict(self, n):
+	def loadModel(self):
+		"""
+		Build the inference model and load trained weights,
+		weights stay random if weightspath is None, e.g. to benchmark without a trained model
+		"""
 		base_model = sm.Unet(self.BACKBONE, classes=self.nclasses, activation=self.activation, encoder_freeze=self.encoder_freeze)
 		inp = Input(shape=(self.shape[0], self.shape[1], 1))
 		l1 = Conv2D(3, (1, 1))(inp) # map N channels data to 3 channels
 		out = base_model(l1)
 		model = Model(inp, out, name=base_model.name)
-		model.load_weights(self.weightspath)
-
-		test = self.testGenie(n)
-		results = model.predict(test, self.batch_size) # read about this one
+		if self.weightspath: model.load_weights(self.weightspath)
+		return model
 
-		label = np.zeros(results.shape[:-1], dtype = 'uint8')
-		for i in range(self.nclasses):
-			result = results[:, :, :, i]
-			label[result>0.5] = i
-			
-		return label
+	def predict(self, n, tiled=False, clean=False):
+		"""
+		Segment fish n
+
+		parameters
+		n : fish number
+		tiled : segment the whole aligned scan with overlapping tiles
+			instead of the ROI around the cc centre, so fish without centres can be predicted
+		clean : keep only the largest 3d connected component of each otolith class
+		"""
+		if self.predictor is None: self.predictor = Predictor(self)
+		return self.predictor.predict(n, tiled=tiled, clean=clean)
 	
 	def dataGenie(self, batch_size, data_gen_args, fish_nums):
 		imagegen = ImageDataGenerator(**data_gen_args, rescale = 1./65535)
@@ -143,14 +179,8 @@ class Unet():
 			center[0] = int(roiZ/2) # Change center to 0 because only read necessary slices but cant do that with labels since hdf5
 			ct = ctreader.crop_around_center3d(ct, center = center, roiSize=roiSize, roiZ=roiZ)
 
-			new_mask = np.zeros(label.shape + (num_classes,))
-			for i in range(num_classes):
-				if i == 2 and self.organ == 'Otoliths': continue # skip utricular otoliths
-				#for one pixel in the image, find the class in mask and convert it into one-hot vector
-				new_mask[label == i,i] = 1
-			
-			mask = np.reshape(new_mask,(new_mask.shape[0],new_mask.shape[1],new_mask.shape[2],new_mask.shape[3]))
-			label = mask
+			skip = [2] if self.organ == 'Otoliths' else [] # skip utricular otoliths
+			label = onehot(label, num_classes, skip)
 			ct_list.append(ct)
 			label_list.append(label)
 			ct, label = None, None
@@ -158,7 +188,6 @@ class Unet():
 		ct_list = np.vstack(ct_list)
 		label_list = np.vstack(label_list)
 		ct_list = np.array(ct_list, dtype='float32')
-		label_list = np.array(label_list, dtype='float32')
 		ct_list      = ct_list[:,:,:,np.newaxis] # add final axis to show datagens its grayscale
 
 		print('[dataGenie] Initialising image and mask generators')
@@ -193,14 +222,16 @@ class Unet():
 
 		return np.array(xdata), np.array(ydata), sample_weights
 
-	def testGenie(self, n):
-		ctreader = CTreader()
+	def testGenie(self, n, ctreader=None, centres=None):
+		# pass ctreader and centres to reuse them between fish
+		if ctreader is None: ctreader = CTreader()
 		# center, error = cc(num, template, thresh=200, roiSize=50)
-		centres_path = ctreader.dataset_path / f'Metadata/cc_centres_{self.organ}.json'
-		with open(centres_path, 'r') as fp:
-			centres = json.load(fp)
+		if centres is None:
+			centres_path = ctreader.dataset_path / f'Metadata/cc_centres_{self.organ}.json'
+			with open(centres_path, 'r') as fp:
+				centres = json.load(fp)
 		
-		center = centres[str(n)]
+		center = list(centres[str(n)])
 		z_center = center[0] # Find center of cc result and only read roi from slices
 		roiZ=self.roiZ
 		roiSize=self.shape[0]
@@ -1,4 +1,16 @@
 # u net model is from https://github.com/zhixuhao/unet
 
 from .Unet import *
-from .dataGenie import *
\ No newline at end of file
+from .dataGenie import *
+from .dataStream import *
+from .losses import *
+from .augment import *
+from .sampler import *
+from .roiCache import *
+from .tiling import *
+from .postprocess import *
+from .Predictor import *
+from .predictionJob import *
+from .pipeline import *
+from .export import *
+from .callbacks import *
\ No newline at end of file
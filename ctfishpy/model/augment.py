@@ -0,0 +1,93 @@
+import numpy as np
+import math
+import cv2
+
+BORDERS = {
+	'constant'	: cv2.BORDER_CONSTANT,
+	'nearest'	: cv2.BORDER_REPLICATE,
+	'reflect'	: cv2.BORDER_REFLECT,
+	'wrap'		: cv2.BORDER_WRAP,
+}
+
+
+class Augmenter():
+	"""
+	Joint image and label augmentation
+
+	One random affine is sampled per sample and warped once with cv2,
+	linear for the image and nearest for the integer label so it stays a valid label.
+	Takes the same arguments as keras' ImageDataGenerator so data_gen_args can be reused.
+	Shifts below 1 are a fraction of the image size, otherwise pixels.
+	"""
+
+	def __init__(self, rotation_range=0, width_shift_range=0, height_shift_range=0,
+				shear_range=0, zoom_range=0, horizontal_flip=False, vertical_flip=False,
+				fill_mode='constant', cval=0):
+		self.rotation_range = rotation_range
+		self.width_shift_range = width_shift_range
+		self.height_shift_range = height_shift_range
+		self.shear_range = shear_range
+		if np.isscalar(zoom_range): zoom_range = [1 - zoom_range, 1 + zoom_range]
+		self.zoom_range = zoom_range
+		self.horizontal_flip = horizontal_flip
+		self.vertical_flip = vertical_flip
+		if fill_mode not in BORDERS: raise ValueError(f'[Augmenter] fill_mode {fill_mode} not supported')
+		self.border = BORDERS[fill_mode]
+		self.cval = cval
+
+	def is_identity(self):
+		return not (self.rotation_range or self.width_shift_range or self.height_shift_range
+			or self.shear_range or self.zoom_range[0] != 1 or self.zoom_range[1] != 1
+			or self.horizontal_flip or self.vertical_flip)
+
+	def random_transform(self, shape, rng):
+		"""
+		Sample one affine transform for an image of shape (height, width)
+		returns 2x3 matrix for cv2.warpAffine
+		"""
+		h, w = shape[:2]
+		theta = math.radians(rng.uniform(-self.rotation_range, self.rotation_range))
+		shear = math.radians(rng.uniform(-self.shear_range, self.shear_range))
+		zx, zy = rng.uniform(self.zoom_range[0], self.zoom_range[1], 2)
+		tx = rng.uniform(-self.width_shift_range, self.width_shift_range)
+		ty = rng.uniform(-self.height_shift_range, self.height_shift_range)
+		if abs(self.width_shift_range) < 1: tx *= w
+		if abs(self.height_shift_range) < 1: ty *= h
+		fx = -1 if self.horizontal_flip and rng.random() < 0.5 else 1
+		fy = -1 if self.vertical_flip and rng.random() < 0.5 else 1
+
+		rotation = np.array([[math.cos(theta), -math.sin(theta)], [math.sin(theta), math.cos(theta)]])
+		shearing = np.array([[1, -math.sin(shear)], [0, math.cos(shear)]])
+		scaling = np.diag([zx * fx, zy * fy])
+		A = rotation @ shearing @ scaling
+
+		# transform around the image centre then shift
+		c = np.array([(w - 1) / 2, (h - 1) / 2])
+		t = c + np.array([tx, ty]) - A @ c
+		return np.hstack([A, t[:, np.newaxis]]).astype('float32')
+
+	def apply(self, image, label, matrix):
+		"""
+		Warp a single 2d image and its label with the same transform
+		"""
+		h, w = image.shape[:2]
+		image = cv2.warpAffine(image, matrix, (w, h), flags=cv2.INTER_LINEAR,
+					borderMode=self.border, borderValue=self.cval)
+		label = cv2.warpAffine(label, matrix, (w, h), flags=cv2.INTER_NEAREST,
+					borderMode=self.border, borderValue=0)
+		return image, label
+
+	def augment_batch(self, images, labels, rng):
+		"""
+		Augment a batch of 2d images and integer labels in place
+
+		parameters
+		images : (batch, x, y) float32 array
+		labels : (batch, x, y) uint8 array
+		rng : numpy Generator used to sample transforms
+		"""
+		if self.is_identity(): return images, labels
+		for i in range(len(images)):
+			matrix = self.random_transform(images[i].shape, rng)
+			images[i], labels[i] = self.apply(images[i], labels[i], matrix)
+		return images, labels
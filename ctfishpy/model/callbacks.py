@@ -0,0 +1,101 @@
+from tensorflow.keras.callbacks import Callback
+import numpy as np
+import resource
+import time
+import csv
+import os
+
+
+def peak_rss_mb():
+	"""
+	Peak resident memory of this process and of finished child processes in MB
+	"""
+	# ru_maxrss is in kilobytes on linux
+	own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+	children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+	return round(own, 1), round(children, 1)
+
+
+class ThroughputLogger(Callback):
+	"""
+	Log training throughput and data stalls for every epoch to csv
+
+	Columns are samples per second, seconds in train steps and between them, the median and
+	95th percentile step, peak RSS and the mean and 95th percentile time DataStream workers
+	took to assemble a batch.
+
+	Steps are timed from on_train_batch_begin to on_train_batch_end. Keras takes each batch
+	from its worker queue inside the step, so time waiting for input is part of step time
+	and shows up as a slow tail of steps. Workers keep up while the mean assembly time
+	divided by workers is below the median step, input_bound flags epochs where it isn't.
+
+	parameters
+	path : csv to write, e.g. next to the loss curve under output/Model/loss_curves/
+	batch_size : samples per batch
+	timing_log : batch timing file written by DataStream(timing_log=...)
+	workers : processes assembling batches, as passed to model.fit
+	"""
+
+	def __init__(self, path, batch_size, timing_log=None, workers=1):
+		super().__init__()
+		self.path = path
+		self.batch_size = batch_size
+		self.timing_log = timing_log
+		self.workers = workers
+		self.timing_offset = 0
+		self.rows = []
+
+	def on_epoch_begin(self, epoch, logs=None):
+		self.steps = []
+		self.train_seconds = None
+		self.epoch_start = time.perf_counter()
+
+	def on_train_batch_begin(self, batch, logs=None):
+		self.step_start = time.perf_counter()
+
+	def on_train_batch_end(self, batch, logs=None):
+		self.steps.append(time.perf_counter() - self.step_start)
+
+	def on_test_begin(self, logs=None):
+		# validation runs inside the epoch so leave it out of training time
+		self.train_seconds = time.perf_counter() - self.epoch_start
+
+	def on_epoch_end(self, epoch, logs=None):
+		train_seconds = self.train_seconds or time.perf_counter() - self.epoch_start
+		steps = np.array(self.steps)
+		step_median = float(np.median(steps)) if len(steps) else None
+		assembly = self.read_assembly_times()
+		assembly_mean = float(np.mean(assembly)) if len(assembly) else None
+		own_rss, children_rss = peak_rss_mb()
+
+		row = {
+			'epoch'						: epoch,
+			'samples_per_second'		: round(len(steps) * self.batch_size / train_seconds, 2),
+			'train_seconds'				: round(train_seconds, 3),
+			'train_step_seconds'		: round(float(steps.sum()), 3),
+			'between_steps_seconds'		: round(train_seconds - float(steps.sum()), 3),
+			'step_median'				: round(step_median, 4) if len(steps) else None,
+			'step_p95'					: round(float(np.percentile(steps, 95)), 4) if len(steps) else None,
+			'peak_rss_mb'				: own_rss,
+			'peak_worker_rss_mb'		: children_rss,
+			'batch_assembly_mean'		: round(assembly_mean, 4) if len(assembly) else None,
+			'batch_assembly_p95'		: round(float(np.percentile(assembly, 95)), 4) if len(assembly) else None,
+			'input_bound'				: assembly_mean / self.workers > step_median if len(assembly) and len(steps) else None,
+		}
+		self.rows.append(row)
+		new = not os.path.isfile(self.path)
+		with open(self.path, 'a', newline='') as f:
+			writer = csv.DictWriter(f, fieldnames=list(row.keys()))
+			if new: writer.writeheader()
+			writer.writerow(row)
+
+	def read_assembly_times(self):
+		# read the lines DataStream workers appended since last epoch
+		if self.timing_log is None or not os.path.isfile(self.timing_log): return []
+		with open(self.timing_log, 'rb') as f:
+			f.seek(self.timing_offset)
+			lines = f.readlines()
+		# the last line may still be being written
+		if lines and not lines[-1].endswith(b'\n'): lines.pop()
+		self.timing_offset += sum(len(line) for line in lines)
+		return [float(line.split(b',')[-1]) for line in lines if line.strip()]
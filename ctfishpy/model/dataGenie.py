@@ -1,6 +1,7 @@
 from tensorflow.keras.preprocessing.image import ImageDataGenerator
 import numpy as np
 from ..controller import CTreader
+from .dataStream import onehot
 #from ..controller import cc
 import gc
 import cv2
@@ -48,16 +49,7 @@ def dataGenie(batch_size, data_gen_args, fish_nums = None):
 
         num_classes = 4
 
-        new_mask = np.zeros(label.shape + (num_classes,))
-        for i in range(num_classes):
-            #for one pixel in the image, find the class in mask and convert it into one-hot vector
-            #index = np.where(mask == i)
-            #index_mask = (index[0],index[1],index[2],np.zeros(len(index[0]),dtype = np.int64) + i) if (len(mask.shape) == 4) else (index[0],index[1],np.zeros(len(index[0]),dtype = np.int64) + i)
-            #new_mask[index_mask] = 1
-            new_mask[label == i,i] = 1
-        
-        mask = np.reshape(new_mask,(new_mask.shape[0],new_mask.shape[1],new_mask.shape[2],new_mask.shape[3]))
-        label = mask
+        label = onehot(label, num_classes)
         ct_list.append(ct)
         label_list.append(label)
         ct, label = None, None
@@ -66,7 +58,6 @@ def dataGenie(batch_size, data_gen_args, fish_nums = None):
     label_list = np.vstack(label_list)
 
     ct_list = np.array(ct_list, dtype='float32')
-    label_list = np.array(label_list, dtype='float32')
     
     # import pdb; pdb.set_trace()
     ct_list      = ct_list[:,:,:,np.newaxis] # add final axis to show datagens its grayscale
@@ -0,0 +1,182 @@
+from ..controller import CTreader
+from .augment import Augmenter
+from .roi import read_roi
+from .roiCache import ROICache
+from .sampler import OccupancyIndex, SliceSampler
+from collections import OrderedDict
+from tensorflow.keras.utils import Sequence
+import numpy as np
+import threading
+import time
+import os
+import json
+
+IGNORE = 255 # sparse label value for classes left out of training
+
+
+def onehot(label, nclasses, skip=(), dtype='uint8'):
+	"""
+	One hot encode an integer label with a single lookup
+	Classes in skip and values of nclasses or more are encoded as all zeros
+
+	returns array shaped label.shape + (nclasses,)
+	"""
+	label = np.asarray(label)
+	size = 256 if label.dtype == 'uint8' else max(256, int(label.max()) + 1)
+	lut = np.zeros((size, nclasses), dtype=dtype)
+	lut[:nclasses] = np.eye(nclasses, dtype=dtype)
+	lut[list(skip)] = 0
+	return lut[label]
+
+
+def sparse_targets(label, skip=()):
+	"""
+	Integer targets for sparse losses, skipped classes are set to IGNORE
+	which one hot encodes to all zeros inside the loss
+
+	returns uint8 array shaped label.shape + (1,)
+	"""
+	lut = np.arange(256, dtype='uint8')
+	lut[list(skip)] = IGNORE
+	return lut[label][..., np.newaxis]
+
+
+class DataStream(Sequence):
+	"""
+	Keras Sequence that streams augmented training batches fish by fish
+
+	Instead of loading every fish up front only `fish_cache` ROIs are kept in memory,
+	and slices are ordered so the batches of a group of fish follow each other.
+	Pass to model.fit with workers, use_multiprocessing and shuffle=False so batches are
+	augmented in parallel worker processes and prefetched through keras' queue.
+	Every worker process has its own cache and batches of a group are spread over them,
+	so a group can be read up to once per worker each epoch and up to
+	workers * fish_cache ROIs are held in memory.
+
+	parameters
+	fish_nums : list of fish to train on
+	batch_size : number of slices per batch
+	data_gen_args : augmentation arguments for Augmenter (same as ImageDataGenerator)
+	fish_cache : number of fish ROIs to keep in memory
+	sparse : yield integer targets for sparse losses instead of uint8 one hot
+	foreground_fraction : if set, draw this fraction of slices from ones containing the organ
+	cache : read ROIs through the persistent ROICache instead of from tiffs every run
+	timing_log : file to append 'pid,batch,seconds' to for every assembled batch
+	"""
+
+	def __init__(self, fish_nums, batch_size, data_gen_args, organ='Otoliths', roiZ=125,
+				shape=(224,224), nclasses=3, shuffle=True, fish_cache=2, seed=2, sparse=False,
+				foreground_fraction=None, cache=False, timing_log=None):
+		self.fish_nums = list(fish_nums)
+		self.batch_size = batch_size
+		self.organ = organ
+		self.roiZ = roiZ
+		self.roiSize = shape[0]
+		self.nclasses = nclasses
+		self.shuffle = shuffle
+		self.fish_cache = fish_cache
+		self.seed = seed
+		self.sparse = sparse
+		self.epoch = 0
+		self.skip = [2] if organ == 'Otoliths' else [] # skip utricular otoliths
+		self.augmenter = Augmenter(**data_gen_args)
+
+		self.ctreader = CTreader()
+		centres_path = self.ctreader.dataset_path / f'Metadata/cc_centres_{self.organ}.json'
+		with open(centres_path, 'r') as fp:
+			centres = json.load(fp)
+		self.centres = {n : centres[str(n)] for n in self.fish_nums}
+
+		# ct is read in range(z - roiZ/2, z + roiZ/2) so this is how many slices each fish has
+		self.slices_per_fish = 2 * int(roiZ/2)
+		self.cache = ROICache(self.ctreader, organ, roiZ, self.roiSize) if cache else None
+		self.timing_log = timing_log
+
+		self.sampler = None
+		if foreground_fraction is not None:
+			occupancy = OccupancyIndex(self.ctreader, organ, roiZ, self.roiSize, nclasses).build(self.centres)
+			classes = [c for c in range(1, nclasses) if c not in self.skip]
+			self.sampler = SliceSampler(occupancy, foreground_fraction, classes)
+		self._cache = OrderedDict()
+		self._lock = threading.Lock()
+		self.on_epoch_end()
+
+	def __len__(self):
+		return len(self.index) // self.batch_size
+
+	def on_epoch_end(self):
+		"""
+		Order (fish, slice) pairs for the next epoch
+		Slices are shuffled within groups of `fish_cache` fish so the cache is read in order
+		and drawn by the foreground sampler if there is one
+		"""
+		rng = np.random.default_rng(self.seed + self.epoch)
+		self.epoch += 1
+		fish = list(self.fish_nums)
+		if self.shuffle: rng.shuffle(fish)
+
+		index = []
+		for i in range(0, len(fish), self.fish_cache):
+			group = []
+			for n in fish[i:i+self.fish_cache]:
+				if self.sampler is None: slices = range(self.slices_per_fish)
+				else: slices = self.sampler.sample(n, self.slices_per_fish, rng)
+				group.extend((n, int(z)) for z in slices)
+			if self.shuffle: group = [group[j] for j in rng.permutation(len(group))]
+			index.extend(group)
+		self.index = index
+
+	def load_fish(self, n):
+		"""
+		Return (ct, label) ROI for fish n, reading it if it isn't cached
+		"""
+		with self._lock:
+			if n in self._cache:
+				self._cache.move_to_end(n)
+				return self._cache[n]
+
+		if self.cache is not None: ct, label = self.cache.get(n, self.centres[n])
+		else: ct, label = read_roi(self.ctreader, n, self.centres[n], self.roiZ, self.roiSize, self.organ)
+
+		with self._lock:
+			self._cache[n] = (ct, label)
+			while len(self._cache) > self.fish_cache:
+				self._cache.popitem(last=False)
+		return ct, label
+
+	def prepare(self):
+		"""
+		Fill the ROI cache for every fish up front so worker processes only open shards
+		"""
+		if self.cache is None: return
+		for n in self.fish_nums: self.cache.get(n, self.centres[n])
+		print(f'[DataStream] ROI cache {self.cache.stats()}')
+
+	def encode(self, label):
+		"""
+		Encode integer label as training targets
+		"""
+		if self.sparse: return sparse_targets(label, self.skip)
+		return onehot(label, self.nclasses, self.skip)
+
+	def __getitem__(self, i):
+		start = time.perf_counter()
+		pairs = self.index[i*self.batch_size : (i+1)*self.batch_size]
+		rng = np.random.default_rng([self.seed, self.epoch, i])
+
+		images = np.zeros((len(pairs), self.roiSize, self.roiSize), dtype='float32')
+		labels = np.zeros((len(pairs), self.roiSize, self.roiSize), dtype='uint8')
+		for j, (n, z) in enumerate(pairs):
+			ct, label = self.load_fish(n)
+			images[j] = ct[z]
+			labels[j] = label[z]
+		images /= 65535.
+
+		# one transform per sample applied to both image and label
+		images, labels = self.augmenter.augment_batch(images, labels, rng)
+		batch = images[:, :, :, np.newaxis], self.encode(labels)
+
+		if self.timing_log is not None:
+			with open(self.timing_log, 'a') as f:
+				f.write(f'{os.getpid()},{i},{time.perf_counter() - start:.4f}\n')
+		return batch
@@ -0,0 +1,181 @@
+from .roi import read_label_roi
+from .postprocess import probs_to_label
+from pathlib2 import Path
+import tensorflow as tf
+import numpy as np
+import time
+import json
+
+FORMATS = {'savedmodel' : '', 'tflite' : '.tflite', 'onnx' : '.onnx'}
+
+
+def export_model(unet, fmt='tflite', quantize=None, path=None):
+	"""
+	Convert the trained checkpoint into a cpu friendly artifact
+
+	parameters
+	unet : Unet whose weightspath to export
+	fmt : 'savedmodel', 'tflite' or 'onnx'
+	quantize : None, 'float16' or 'int8' (dynamic range), tflite only
+	path : output path, defaults to output/Model/unet_<quantize>.<fmt>
+
+	returns path of the artifact
+	"""
+	if fmt not in FORMATS: raise ValueError(f'[export] unknown format {fmt}')
+	if quantize not in [None, 'float16', 'int8']: raise ValueError(f'[export] unknown quantization {quantize}')
+	if quantize and fmt != 'tflite': raise ValueError('[export] quantization is only supported for tflite')
+	if path is None: path = f"output/Model/unet_{quantize or 'float32'}{FORMATS[fmt]}"
+	path = str(path)
+
+	model = unet.loadModel()
+	# fix the input signature so the graph is traced once for any batch size
+	spec = tf.TensorSpec((None, unet.shape[0], unet.shape[1], 1), tf.float32, name='input')
+	serve = tf.function(lambda x : model(x, training=False), input_signature=[spec])
+
+	if fmt == 'savedmodel':
+		tf.saved_model.save(model, path, signatures=serve.get_concrete_function())
+
+	elif fmt == 'tflite':
+		converter = tf.lite.TFLiteConverter.from_concrete_functions([serve.get_concrete_function()], model)
+		if quantize: converter.optimizations = [tf.lite.Optimize.DEFAULT]
+		if quantize == 'float16': converter.target_spec.supported_types = [tf.float16]
+		with open(path, 'wb') as f:
+			f.write(converter.convert())
+
+	elif fmt == 'onnx':
+		try:
+			import tf2onnx
+		except ImportError:
+			raise ImportError('[export] onnx export needs tf2onnx, pip install tf2onnx')
+		tf2onnx.convert.from_keras(model, input_signature=[spec], opset=13, output_path=path)
+
+	print(f'[export] wrote {fmt} model to {path}')
+	return path
+
+
+class ExportedModel():
+	"""
+	Common predict interface of exported models so Predictor can use them like a keras model
+	"""
+
+	def predict_on_batch(self, x):
+		raise NotImplementedError
+
+	def predict(self, x, batch_size=64):
+		return np.concatenate([self.predict_on_batch(x[i:i+batch_size]) for i in range(0, len(x), batch_size)])
+
+
+class SavedModel(ExportedModel):
+	def __init__(self, path):
+		self.model = tf.saved_model.load(str(path))
+		self.fn = self.model.signatures['serving_default']
+
+	def predict_on_batch(self, x):
+		outputs = self.fn(tf.constant(x, dtype=tf.float32))
+		return list(outputs.values())[0].numpy()
+
+
+class TFLiteModel(ExportedModel):
+	def __init__(self, path, threads=None):
+		self.interpreter = tf.lite.Interpreter(model_path=str(path), num_threads=threads)
+		self.input = self.interpreter.get_input_details()[0]['index']
+		self.output = self.interpreter.get_output_details()[0]['index']
+		self.batch = None
+
+	def predict_on_batch(self, x):
+		x = np.ascontiguousarray(x, dtype='float32')
+		# only reallocate when the batch size changes
+		if self.batch != x.shape[0]:
+			self.interpreter.resize_tensor_input(self.input, x.shape)
+			self.interpreter.allocate_tensors()
+			self.batch = x.shape[0]
+		self.interpreter.set_tensor(self.input, x)
+		self.interpreter.invoke()
+		return self.interpreter.get_tensor(self.output)
+
+
+class ONNXModel(ExportedModel):
+	def __init__(self, path, threads=None):
+		try:
+			import onnxruntime as ort
+		except ImportError:
+			raise ImportError('[export] onnx models need onnxruntime, pip install onnxruntime')
+		options = ort.SessionOptions()
+		if threads: options.intra_op_num_threads = threads
+		self.session = ort.InferenceSession(str(path), options, providers=['CPUExecutionProvider'])
+		self.input = self.session.get_inputs()[0].name
+
+	def predict_on_batch(self, x):
+		return self.session.run(None, {self.input : np.asarray(x, dtype='float32')})[0]
+
+
+def load_exported(path, threads=None):
+	"""
+	Load an artifact from export_model, the format is picked from the file suffix
+	"""
+	path = Path(path)
+	if path.suffix == '.tflite': return TFLiteModel(path, threads)
+	if path.suffix == '.onnx': return ONNXModel(path, threads)
+	return SavedModel(path)
+
+
+def dice(a, b, classes):
+	"""
+	Dice overlap of two integer labels for each class
+	"""
+	scores = {}
+	for c in classes:
+		x, y = a == c, b == c
+		total = x.sum() + y.sum()
+		scores[int(c)] = float(2 * (x & y).sum() / total) if total else 1.
+	return scores
+
+
+def benchmark(predictor, artifacts, n=None, repeats=3, threads=None):
+	"""
+	Compare exported models against the keras model on one held-out fish
+
+	Reports latency of one batch, throughput over the fish's ROI,
+	dice against the ground truth label and dice against the keras prediction
+
+	parameters
+	predictor : Predictor using the original keras model
+	artifacts : list of paths from export_model
+	n : fish to test on, defaults to the first validation fish
+
+	returns {name : results} and saves it to output/Model/export_benchmark.json
+	"""
+	unet = predictor.unet
+	if n is None: n = unet.val_sample[0]
+	x = predictor.preprocess(n, predictor.read(n))
+	truth = read_label_roi(predictor.ctreader, n, predictor.centres[str(n)], unet.roiZ, unet.shape[0], unet.organ)
+	classes = range(1, unet.nclasses)
+
+	models = {'keras' : predictor.model}
+	for path in artifacts:
+		models[Path(path).name] = load_exported(path, threads)
+
+	results, reference = {}, None
+	for name, model in models.items():
+		batch = x[:unet.batch_size]
+		model.predict_on_batch(batch) # warm up
+		start = time.perf_counter()
+		for _ in range(repeats): model.predict_on_batch(batch)
+		latency = (time.perf_counter() - start) / repeats
+
+		start = time.perf_counter()
+		label = probs_to_label(model.predict(x, unet.batch_size), unet.confidence_thresh)
+		seconds = time.perf_counter() - start
+		if reference is None: reference = label
+
+		results[name] = {
+			'batch_latency_seconds'	: round(latency, 4),
+			'slices_per_second'		: round(len(x) / seconds, 2),
+			'dice_truth'			: dice(label, truth, classes),
+			'dice_keras'			: dice(label, reference, classes),
+		}
+		print(f'[benchmark] {name}: {results[name]}')
+
+	with open('output/Model/export_benchmark.json', 'w') as f:
+		json.dump({'fish' : n, 'results' : results}, f, indent=4)
+	return results
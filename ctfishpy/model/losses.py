@@ -0,0 +1,62 @@
+from segmentation_models.base import Loss
+import tensorflow as tf
+import numpy as np
+
+
+def _sparse_to_onehot(gt, nclasses):
+	"""
+	Expand (batch, x, y, 1) integer targets to one hot inside the graph
+	Values outside range(nclasses) (e.g. IGNORE) become all zeros
+	"""
+	gt = tf.cast(gt[..., 0], tf.int32)
+	return tf.one_hot(gt, nclasses, dtype=tf.float32)
+
+
+class SparseDiceLoss(Loss):
+	"""
+	Dice loss for integer targets, matches sm.losses.DiceLoss on the one hot version
+	so labels can be fed as uint8 (x, y, 1) instead of a float one hot per class
+
+	parameters
+	nclasses : number of output channels of the model
+	class_weights : weight for each class score
+	"""
+
+	def __init__(self, nclasses, class_weights=None, beta=1, smooth=1e-5):
+		super().__init__(name='sparse_dice_loss')
+		self.nclasses = nclasses
+		self.class_weights = np.asarray(class_weights if class_weights is not None else 1, dtype='float32')
+		self.beta = beta
+		self.smooth = smooth
+
+	def __call__(self, gt, pr):
+		gt = _sparse_to_onehot(gt, self.nclasses)
+		pr = tf.cast(pr, tf.float32)
+		axes = [0, 1, 2]
+
+		tp = tf.reduce_sum(gt * pr, axis=axes)
+		fp = tf.reduce_sum(pr, axis=axes) - tp
+		fn = tf.reduce_sum(gt, axis=axes) - tp
+
+		b2 = self.beta ** 2
+		score = ((1 + b2) * tp + self.smooth) / ((1 + b2) * tp + b2 * fn + fp + self.smooth)
+		score = tf.reduce_mean(score * self.class_weights)
+		return 1 - score
+
+
+class SparseCategoricalFocalLoss(Loss):
+	"""
+	Categorical focal loss for integer targets, matches sm.losses.CategoricalFocalLoss
+	"""
+
+	def __init__(self, nclasses, alpha=0.25, gamma=2.):
+		super().__init__(name='sparse_focal_loss')
+		self.nclasses = nclasses
+		self.alpha = alpha
+		self.gamma = gamma
+
+	def __call__(self, gt, pr):
+		gt = _sparse_to_onehot(gt, self.nclasses)
+		pr = tf.clip_by_value(tf.cast(pr, tf.float32), 1e-7, 1 - 1e-7)
+		loss = - gt * (self.alpha * tf.pow((1 - pr), self.gamma) * tf.math.log(pr))
+		return tf.reduce_mean(loss)
@@ -0,0 +1,146 @@
+import tensorflow as tf
+import threading
+import queue
+import time
+
+STOP = object() # put on a queue once per downstream worker when a stage is finished
+
+
+def set_tf_threads(intra_op=None, inter_op=None):
+	"""
+	Set tensorflow's thread pools, must be called before any model is built
+	0 or None leaves tensorflow's default of one thread per core
+	"""
+	if intra_op: tf.config.threading.set_intra_op_parallelism_threads(intra_op)
+	if inter_op: tf.config.threading.set_inter_op_parallelism_threads(inter_op)
+
+
+class Stage():
+	"""
+	One step of a Pipeline run by `workers` threads
+
+	parameters
+	name : name used in the utilisation report
+	fn : function fn(n, data) returning data for the next stage
+	workers : number of threads running fn
+	"""
+
+	def __init__(self, name, fn, workers=1):
+		self.name = name
+		self.fn = fn
+		self.workers = workers
+		self.reset()
+
+	def reset(self):
+		self.busy = 0. # seconds spent in fn
+		self.starved = 0. # seconds waiting for input
+		self.blocked = 0. # seconds waiting for the next stage to take output
+		self.items = 0
+		self.lock = threading.Lock()
+		self.running = self.workers
+
+
+class Pipeline():
+	"""
+	Run items through stages connected by bounded queues so every stage works at once
+	e.g. reading the next fish while the current one is in the model
+
+	Stages run in threads, which overlap because tifffile, cv2 and tensorflow release the GIL.
+	An item that raises in a stage skips the remaining stages and comes out with its error.
+
+	parameters
+	stages : list of Stage
+	queue_size : items allowed to wait between two stages
+	"""
+
+	def __init__(self, stages, queue_size=2):
+		self.stages = stages
+		self.queue_size = queue_size
+		self.wall = 0.
+
+	def run(self, items):
+		"""
+		Push items through every stage
+
+		yields {'n', 'data', 'times', 'error'} for every item as it leaves the last stage
+		"""
+		queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+		threads = []
+		for i, stage in enumerate(self.stages):
+			stage.reset()
+			downstream = self.stages[i+1].workers if i+1 < len(self.stages) else 1
+			for w in range(stage.workers):
+				t = threading.Thread(target=self._work, args=(stage, queues[i], queues[i+1], downstream), daemon=True)
+				t.start()
+				threads.append(t)
+
+		def feed():
+			for n in items:
+				queues[0].put({'n' : n, 'data' : None, 'times' : {}, 'error' : None})
+			for _ in range(self.stages[0].workers): queues[0].put(STOP)
+		feeder = threading.Thread(target=feed, daemon=True)
+
+		start = time.perf_counter()
+		feeder.start()
+		while True:
+			item = queues[-1].get()
+			if item is STOP: break
+			yield item
+		self.wall = time.perf_counter() - start
+		for t in threads: t.join()
+
+	def _work(self, stage, inq, outq, downstream):
+		while True:
+			t0 = time.perf_counter()
+			item = inq.get()
+			t1 = time.perf_counter()
+			if item is STOP: break
+
+			if item['error'] is None:
+				try:
+					item['data'] = stage.fn(item['n'], item['data'])
+				except Exception as e:
+					item['data'] = None
+					item['error'] = f'{stage.name}: {e!r}'
+			t2 = time.perf_counter()
+			item['times'][stage.name] = round(t2 - t1, 3)
+
+			outq.put(item)
+			t3 = time.perf_counter()
+			with stage.lock:
+				stage.starved += t1 - t0
+				stage.busy += t2 - t1
+				stage.blocked += t3 - t2
+				stage.items += 1
+
+		with stage.lock:
+			stage.running -= 1
+			last = stage.running == 0
+		if last:
+			for _ in range(downstream): outq.put(STOP)
+
+	def report(self):
+		"""
+		Utilisation of each stage over the last run
+		busy is the fraction of the stage's worker time spent working,
+		the stage with the highest busy fraction is the bottleneck
+		"""
+		report = {'wall_seconds' : round(self.wall, 3)}
+		for stage in self.stages:
+			capacity = max(self.wall * stage.workers, 1e-9)
+			report[stage.name] = {
+				'workers'	: stage.workers,
+				'items'		: stage.items,
+				'busy'		: round(stage.busy / capacity, 3),
+				'starved'	: round(stage.starved / capacity, 3),
+				'blocked'	: round(stage.blocked / capacity, 3),
+			}
+		return report
+
+	def print_report(self):
+		report = self.report()
+		print(f"[Pipeline] wall time {report['wall_seconds']:.1f}s")
+		for stage in self.stages:
+			r = report[stage.name]
+			print(f"[Pipeline] {stage.name:<12} workers {r['workers']}  busy {r['busy']:.0%}  starved {r['starved']:.0%}  blocked {r['blocked']:.0%}")
+		return report
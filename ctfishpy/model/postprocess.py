@@ -0,0 +1,82 @@
+from scipy import ndimage
+import numpy as np
+
+
+def probs_to_label(probs, thresh=0.5, out=None):
+	"""
+	Turn softmax outputs into a uint8 label with argmax and a confidence threshold
+	Voxels whose most likely class is below thresh are background.
+	Works slice by slice so only one slice of argmax temporaries exists at a time
+
+	parameters
+	probs : (slices, x, y, nclasses) probabilities
+	out : optional uint8 array shaped (slices, x, y) to write into
+
+	returns uint8 label
+	"""
+	if out is None: out = np.empty(probs.shape[:-1], dtype='uint8')
+	for z in range(len(probs)):
+		idx = probs[z].argmax(axis=-1)
+		conf = np.take_along_axis(probs[z], idx[:, :, np.newaxis], axis=-1)[:, :, 0]
+		idx[conf < thresh] = 0
+		out[z] = idx
+	return out
+
+
+def _find(parent, i):
+	while parent[i] != i:
+		parent[i] = parent[parent[i]]
+		i = parent[i]
+	return i
+
+
+def _chunk_components(label, c, chunk):
+	# 3d connected components of class c in each chunk of slices, numbered after the previous chunk
+	# the mask is made per chunk so no boolean copy of the whole volume exists
+	offset = 0
+	for z0 in range(0, len(label), chunk):
+		lab, n = ndimage.label(label[z0:z0+chunk] == c)
+		yield z0, lab, n, offset
+		offset += n
+
+
+def keep_largest_component(label, c, chunk=64):
+	"""
+	Remove every 3d connected component of class c except the largest, in place
+
+	Components are labelled chunk by chunk so only chunk slices of masks and int32 labels exist at once,
+	and components touching across chunk borders are joined with union find.
+	"""
+	parent, sizes = [], []
+	prev = None
+	for z0, lab, n, offset in _chunk_components(label, c, chunk):
+		parent.extend(range(offset, offset + n))
+		sizes.extend(np.bincount(lab.ravel(), minlength=n+1)[1:])
+		if prev is not None:
+			# join components sharing a face across the chunk border
+			both = (prev > 0) & (lab[0] > 0)
+			pairs = np.unique(np.stack([prev[both], lab[0][both] + offset], axis=1), axis=0)
+			for a, b in pairs:
+				ra, rb = _find(parent, a - 1), _find(parent, b - 1)
+				if ra != rb: parent[rb] = ra
+		prev = np.where(lab[-1] > 0, lab[-1] + offset, 0)
+
+	if len(parent) == 0: return label
+	roots = np.array([_find(parent, i) for i in range(len(parent))])
+	totals = np.bincount(roots, weights=sizes, minlength=len(parent))
+	keep = roots == totals.argmax()
+
+	for z0, lab, n, offset in _chunk_components(label, c, chunk):
+		lut = np.concatenate([[True], keep[offset:offset+n]])
+		block = label[z0:z0+chunk]
+		block[~lut[lab]] = 0
+	return label
+
+
+def keep_largest_components(label, classes, chunk=64):
+	"""
+	Keep only the largest 3d connected component of each class in classes, in place
+	"""
+	for c in classes:
+		keep_largest_component(label, c, chunk)
+	return label
@@ -0,0 +1,132 @@
+from pathlib2 import Path
+from .pipeline import Stage, Pipeline
+import numpy as np
+import h5py
+import json
+import time
+import os
+
+
+class PredictionJob():
+	"""
+	Resumable prediction of many fish into the label store
+
+	Labels are written to Labels/Organs/<name>/<name>.h5 through one open hdf5 handle,
+	and every finished fish is recorded with its timing in manifest.json next to it
+	so an interrupted run carries on from the first unfinished fish.
+
+	parameters
+	predictor : Predictor to segment with
+	name : label store name, defaults to <organ>-unet
+	tiled : segment whole scans instead of the ROI around the cc centre
+	clean : keep only the largest component of each class
+	"""
+
+	def __init__(self, predictor, name=None, tiled=False, clean=False):
+		self.predictor = predictor
+		self.ctreader = predictor.ctreader
+		if name is None: name = f'{predictor.unet.organ}-unet'
+		self.name = name
+		self.tiled = tiled
+		self.clean = clean
+		folder = self.ctreader.dataset_path / f'Labels/Organs/{name}'
+		folder.mkdir(parents=True, exist_ok=True)
+		self.path = folder / f'{name}.h5'
+		self.manifest_path = folder / 'manifest.json'
+		self.manifest = self.load_manifest()
+
+	def load_manifest(self):
+		if self.manifest_path.is_file():
+			with open(self.manifest_path, 'r') as fp:
+				return json.load(fp)
+		return {'done' : {}, 'failed' : {}}
+
+	def save_manifest(self):
+		# write then rename so a crash never leaves a broken manifest
+		tmp = str(self.manifest_path) + '.tmp'
+		with open(tmp, 'w') as fp:
+			json.dump(self.manifest, fp, sort_keys=True, indent=4)
+		os.replace(tmp, str(self.manifest_path))
+
+	def todo(self, fish_list=None):
+		if fish_list is None: fish_list = self.ctreader.fish_nums
+		return [n for n in fish_list if str(n) not in self.manifest['done']]
+
+	def write(self, f, n, label):
+		# dataset may be left over from a run that stopped before the manifest was saved
+		if str(n) in f: del f[str(n)]
+		f.create_dataset(str(n), shape=label.shape, dtype='uint8', data=label, compression=1)
+		f.flush()
+		return label.shape
+
+	def record(self, n, shape, times, error=None):
+		"""
+		Save result of fish n in the manifest
+		"""
+		if error is not None:
+			self.manifest['failed'][str(n)] = error
+			print(f'[PredictionJob] fish {n} failed: {error}')
+		else:
+			self.manifest['done'][str(n)] = {
+				'seconds'	: times,
+				'shape'		: list(shape),
+				'tiled'		: self.tiled,
+				'clean'		: self.clean,
+				'finished'	: time.strftime("%Y-%m-%d-%H-%M-%S"),
+			}
+			self.manifest['failed'].pop(str(n), None)
+			print(f'[PredictionJob] fish {n} done {times}')
+		self.save_manifest()
+
+	def run(self, fish_list=None):
+		"""
+		Predict every unfinished fish in fish_list, or the whole dataset if None
+		Fish that fail are recorded in the manifest and skipped
+
+		returns manifest
+		"""
+		todo = self.todo(fish_list)
+		print(f'[PredictionJob] {len(todo)} fish to predict into {self.path}')
+		with h5py.File(self.path, 'a') as f:
+			for i, n in enumerate(todo):
+				start = time.time()
+				try:
+					label = self.predictor.predict(n, tiled=self.tiled, clean=self.clean)
+				except Exception as e:
+					self.record(n, None, None, error=repr(e))
+					continue
+				predicted = time.time()
+				shape = self.write(f, n, label)
+				written = time.time()
+				times = {'predict' : round(predicted - start, 3), 'write' : round(written - predicted, 3)}
+				self.record(n, shape, times)
+		return self.manifest
+
+	def run_pipelined(self, fish_list=None, read_workers=2, preprocess_workers=2, queue_size=2):
+		"""
+		Same as run but reading, aligning, inference and writing happen at the same time
+		in separate stages, so the disk and cpu cores aren't idle while the other works.
+		Stage utilisation is printed at the end and saved in the manifest under 'pipeline'
+
+		parameters
+		read_workers : threads reading tiffs
+		preprocess_workers : threads aligning and cropping
+		queue_size : fish allowed to wait between stages, bounds memory
+		"""
+		p = self.predictor
+		todo = self.todo(fish_list)
+		print(f'[PredictionJob] {len(todo)} fish to predict into {self.path}')
+		with h5py.File(self.path, 'a') as f:
+			stages = [
+				Stage('read', lambda n, _ : p.read(n, self.tiled), read_workers),
+				Stage('preprocess', lambda n, ct : p.preprocess(n, ct, self.tiled), preprocess_workers),
+				Stage('infer', lambda n, x : p.infer(x, self.tiled, self.clean), 1),
+				Stage('write', lambda n, label : self.write(f, n, label), 1),
+			]
+			pipeline = Pipeline(stages, queue_size)
+			for item in pipeline.run(todo):
+				self.record(item['n'], item['data'], item['times'], error=item['error'])
+
+		self.manifest['pipeline'] = pipeline.print_report()
+		self.save_manifest()
+		return self.manifest
@@ -0,0 +1,25 @@
+def read_label_roi(ctreader, n, center, roiZ, roiSize, organ='Otoliths'):
+	"""
+	Read the aligned label ROI around a centre for one fish
+
+	returns uint8 label shaped (roiZ, roiSize, roiSize)
+	"""
+	label = ctreader.read_label(organ, n=n, align=True)
+	return ctreader.crop_around_center3d(label, center = center, roiSize=roiSize, roiZ=roiZ)
+
+
+def read_roi(ctreader, n, center, roiZ, roiSize, organ='Otoliths'):
+	"""
+	Read the aligned ct and label ROI around a centre for one fish
+	Only the slices of the ROI are read from the tiffs
+
+	returns uint16 ct and uint8 label both shaped (roiZ, roiSize, roiSize)
+	"""
+	z_center = center[0]
+	ct, stack_metadata = ctreader.read(n, r = (z_center - int(roiZ/2), z_center + int(roiZ/2)), align=True)
+	label = read_label_roi(ctreader, n, center, roiZ, roiSize, organ)
+
+	# ct only has the roi slices so move z centre to the middle of them
+	ct_center = [int(roiZ/2), center[1], center[2]]
+	ct = ctreader.crop_around_center3d(ct, center = ct_center, roiSize=roiSize, roiZ=roiZ)
+	return ct, label
@@ -0,0 +1,86 @@
+from .roi import read_roi
+from pathlib2 import Path
+import numpy as np
+import hashlib
+import shutil
+import json
+import os
+
+CACHE_VERSION = 1 # bump to invalidate every shard if roi reading changes
+
+
+class ROICache():
+	"""
+	Persistent cache of prepared training ROIs as memory mappable .npy shards
+
+	Each fish gets its own shard under Cache/rois/ keyed by a hash of everything that
+	changes the ROI (organ, roiZ, roiSize, centre and alignment angle), so any sample
+	list or hyperparameter sweep that uses the same ROIs reads them without decoding tiffs.
+
+	parameters
+	ctreader : CTreader of the dataset
+	path : where to keep shards, defaults to dataset_path/Cache/rois
+	"""
+
+	def __init__(self, ctreader, organ='Otoliths', roiZ=125, roiSize=224, path=None):
+		self.ctreader = ctreader
+		self.organ = organ
+		self.roiZ = roiZ
+		self.roiSize = roiSize
+		self.path = Path(path) if path else ctreader.dataset_path / 'Cache/rois'
+		self.path.mkdir(parents=True, exist_ok=True)
+		with open(ctreader.anglePath, 'r') as fp:
+			self.angles = json.load(fp)
+		self.hits = 0
+		self.misses = 0
+
+	def config(self, n, center):
+		return {
+			'version'	: CACHE_VERSION,
+			'fish'		: int(n),
+			'organ'		: self.organ,
+			'roiZ'		: self.roiZ,
+			'roiSize'	: self.roiSize,
+			'center'	: [int(c) for c in center],
+			'angle'		: self.angles.get(str(n)),
+		}
+
+	def shard_path(self, n, center):
+		config = json.dumps(self.config(n, center), sort_keys=True)
+		key = hashlib.sha1(config.encode()).hexdigest()[:16]
+		return self.path / f'{n}_{key}'
+
+	def get(self, n, center):
+		"""
+		Return (ct, label) ROI of fish n, memory mapped if it is cached
+		"""
+		shard = self.shard_path(n, center)
+		if (shard / 'label.npy').is_file():
+			self.hits += 1
+			print(f'[ROICache] hit fish {n}')
+			ct = np.load(str(shard / 'ct.npy'), mmap_mode='r')
+			label = np.load(str(shard / 'label.npy'), mmap_mode='r')
+			return ct, label
+
+		self.misses += 1
+		print(f'[ROICache] miss fish {n}, reading scan')
+		ct, label = read_roi(self.ctreader, n, center, self.roiZ, self.roiSize, self.organ)
+		self.write(shard, ct, label, self.config(n, center))
+		return ct, label
+
+	def write(self, shard, ct, label, config):
+		# write to a temporary folder and rename so workers never see half written shards
+		tmp = shard.with_name(f'{shard.name}.tmp{os.getpid()}')
+		tmp.mkdir(parents=True, exist_ok=True)
+		np.save(str(tmp / 'ct.npy'), np.ascontiguousarray(ct))
+		np.save(str(tmp / 'label.npy'), np.ascontiguousarray(label))
+		with open(tmp / 'config.json', 'w') as fp:
+			json.dump(config, fp, indent=4)
+		try:
+			os.rename(str(tmp), str(shard))
+		except OSError:
+			# another worker finished this shard first
+			shutil.rmtree(str(tmp), ignore_errors=True)
+
+	def stats(self):
+		return {'hits' : self.hits, 'misses' : self.misses}
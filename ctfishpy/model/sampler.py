@@ -0,0 +1,100 @@
+from .roi import read_label_roi
+import numpy as np
+import json
+
+
+def slice_occupancy(label, nclasses):
+	"""
+	Count voxels of each class in every slice of a label in one bincount
+
+	parameters
+	label : integer label (slices, x, y), values of nclasses or more aren't counted
+
+	returns int array shaped (slices, nclasses)
+	"""
+	z = label.shape[0]
+	flat = label.reshape(z, -1).astype('int64')
+	keep = flat < nclasses
+	flat += (np.arange(z) * nclasses)[:, np.newaxis]
+	counts = np.bincount(flat[keep], minlength=z*nclasses)
+	return counts.reshape(z, nclasses)
+
+
+class OccupancyIndex():
+	"""
+	Per fish slice occupancy of the training ROI, saved to Metadata/occupancy_<organ>.json
+
+	Occupancy is computed once from the label and recomputed only if the ROI
+	(roiZ, roiSize or centre) of that fish changes.
+	"""
+
+	def __init__(self, ctreader, organ='Otoliths', roiZ=125, roiSize=224, nclasses=3):
+		self.ctreader = ctreader
+		self.organ = organ
+		self.roiZ = roiZ
+		self.roiSize = roiSize
+		self.nclasses = nclasses
+		self.path = ctreader.dataset_path / f'Metadata/occupancy_{organ}.json'
+		self.entries = {}
+		if self.path.is_file():
+			with open(self.path, 'r') as fp:
+				self.entries = json.load(fp)
+
+	def get(self, n, center):
+		"""
+		Return (slices, nclasses) voxel counts for fish n, computing them if needed
+		"""
+		roi = [self.roiZ, self.roiSize] + [int(c) for c in center]
+		entry = self.entries.get(str(n))
+		if entry is None or entry['roi'] != roi:
+			label = read_label_roi(self.ctreader, n, center, self.roiZ, self.roiSize, self.organ)
+			entry = {'roi' : roi, 'counts' : slice_occupancy(label, self.nclasses).tolist()}
+			self.entries[str(n)] = entry
+			self.save()
+		return np.array(entry['counts'])
+
+	def build(self, centres):
+		"""
+		Return {fish : counts} for every fish in centres dict
+		"""
+		return {n : self.get(n, center) for n, center in centres.items()}
+
+	def save(self):
+		with open(self.path, 'w') as fp:
+			json.dump(self.entries, fp)
+
+
+class SliceSampler():
+	"""
+	Draw training slices so a set fraction of them contain the organ
+
+	parameters
+	occupancy : {fish : (slices, nclasses) voxel counts}
+	foreground_fraction : fraction of drawn slices that have foreground
+	classes : label classes that count as foreground, defaults to all but background
+	"""
+
+	def __init__(self, occupancy, foreground_fraction=0.5, classes=None):
+		self.foreground_fraction = foreground_fraction
+		self.foreground, self.background = {}, {}
+		for n, counts in occupancy.items():
+			if classes is None: classes = list(range(1, counts.shape[1]))
+			has_fg = counts[:, classes].sum(axis=1) > 0
+			self.foreground[n] = np.flatnonzero(has_fg)
+			self.background[n] = np.flatnonzero(~has_fg)
+
+	def sample(self, n, size, rng):
+		"""
+		Return `size` slice indices of fish n
+		Draws with replacement only when a pool has fewer slices than asked for
+		"""
+		fg, bg = self.foreground[n], self.background[n]
+		k = int(round(size * self.foreground_fraction))
+		if len(fg) == 0: k = 0
+		if len(bg) == 0: k = size
+		picks = np.concatenate([
+			rng.choice(fg, k, replace=k > len(fg)),
+			rng.choice(bg, size - k, replace=size - k > len(bg)),
+		]).astype('int64')
+		rng.shuffle(picks)
+		return picks
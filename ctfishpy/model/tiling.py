@@ -0,0 +1,86 @@
+import numpy as np
+
+
+def tile_positions(size, tile, stride):
+	"""
+	Start positions of tiles covering range(size), the last tile is flush with the end
+	"""
+	if size <= tile: return [0]
+	positions = list(range(0, size - tile, stride))
+	positions.append(size - tile)
+	return positions
+
+
+def blend_window(tile, sigma_scale=1/8):
+	"""
+	2d gaussian weights used to blend overlapping tiles
+	so predictions near tile borders count less than ones near the centre
+	"""
+	windows = []
+	for t in tile:
+		x = np.arange(t) - (t - 1) / 2
+		w = np.exp(-0.5 * (x / (t * sigma_scale)) ** 2)
+		windows.append(w / w.max())
+	window = np.outer(windows[0], windows[1]).astype('float32')
+	return np.maximum(window, 1e-3)
+
+
+def predict_tiled(predict, ct, nclasses, tile=(224,224), overlap=0.5, batch_size=64,
+				blank_thresh=None, chunk=16):
+	"""
+	Sliding window prediction over a whole scan, slice chunk by slice chunk
+
+	Every slice is covered with overlapping tiles which are predicted in large batches
+	and blended with a gaussian window. Tiles whose max intensity is below blank_thresh
+	are not sent to the model and count as background.
+
+	parameters
+	predict : function mapping (batch, x, y, 1) float32 tiles to (batch, x, y, nclasses)
+	ct : uint16 scan (slices, x, y)
+	overlap : fraction of a tile shared with its neighbour
+	blank_thresh : 16 bit intensity below which a tile is skipped, None to predict every tile
+	chunk : slices held as float probabilities at once
+
+	yields (first slice, probabilities) for every chunk of slices
+	"""
+	depth, height, width = ct.shape
+	th, tw = tile
+	ys = tile_positions(height, th, max(1, int(th * (1 - overlap))))
+	xs = tile_positions(width, tw, max(1, int(tw * (1 - overlap))))
+	ph, pw = max(height, th), max(width, tw)
+
+	window = blend_window(tile)
+	weights = np.zeros((ph, pw), dtype='float32')
+	for y in ys:
+		for x in xs:
+			weights[y:y+th, x:x+tw] += window
+	background = np.zeros(nclasses, dtype='float32')
+	background[0] = 1
+
+	for z0 in range(0, depth, chunk):
+		block = ct[z0:z0+chunk]
+		if (ph, pw) != (height, width):
+			block = np.pad(block, ((0, 0), (0, ph - height), (0, pw - width)))
+		n = len(block)
+		probs = np.zeros((n, ph, pw, nclasses), dtype='float32')
+
+		# blank tiles are background everywhere so add them straight away
+		todo = []
+		for y in ys:
+			for x in xs:
+				if blank_thresh is None: keep = np.ones(n, dtype=bool)
+				else: keep = block[:, y:y+th, x:x+tw].max(axis=(1, 2)) >= blank_thresh
+				for z in np.flatnonzero(~keep):
+					probs[z, y:y+th, x:x+tw] += window[:, :, np.newaxis] * background
+				todo.extend((z, y, x) for z in np.flatnonzero(keep))
+
+		for i in range(0, len(todo), batch_size):
+			batch = todo[i:i+batch_size]
+			tiles = np.array([block[z, y:y+th, x:x+tw] for z, y, x in batch], dtype='float32')
+			tiles = tiles[:, :, :, np.newaxis] / 65535.
+			results = predict(tiles)
+			for (z, y, x), result in zip(batch, results):
+				probs[z, y:y+th, x:x+tw] += result * window[:, :, np.newaxis]
+
+		probs /= weights[np.newaxis, :, :, np.newaxis]
+		yield z0, probs[:, :height, :width]
@@ -1,3 +1,5 @@
 from .mainviewer import mainViewer
 from .spinner import spinner
-from .cc_fixer import mainFixer
\ No newline at end of file
+from .cc_fixer import mainFixer
+from .slicecache import TiffVolume, SliceCache
+from .orthoviewer import orthoViewer, OrthoSlicer
\ No newline at end of file
@@ -2,23 +2,100 @@ from qtpy.QtWidgets import QMainWindow, QApplication, QWidget, QPushButton, QToo
 from qtpy.QtGui import QFont, QPixmap, QImage, QCursor
 from qtpy.QtCore import Qt, QTimer
 import qtpy.QtCore as QtCore
+from collections import OrderedDict
 import numpy as np
 import cv2
 import sys
 
+LABEL_COLOURS = {1 : (255, 0, 0), 2 : (255, 255, 0), 3 : (0, 0, 255)}
+
+
+def sample_range(stack, n=None):
+	"""
+	Min and max of n evenly spaced slices, a cheap estimate of the data range
+	that doesn't touch the whole volume
+	Stacks on disk default to fewer slices so the first one shows quickly
+	"""
+	if n is None: n = 16 if isinstance(stack, np.ndarray) else 4
+	if len(stack.shape) == 2: slices = [np.asarray(stack)]
+	else: slices = [np.asarray(stack[i]) for i in np.linspace(0, stack.shape[0]-1, min(n, stack.shape[0])).astype(int)]
+	return float(min(s.min() for s in slices)), float(max(s.max() for s in slices))
+
+
+def window_lut(low, high, dtype):
+	"""
+	Lookup table mapping every value of an integer dtype to 0 - 255 for the window low - high
+	None for dtypes too big to tabulate
+	"""
+	dtype = np.dtype(dtype)
+	if dtype.kind != 'u' or dtype.itemsize > 2: return None
+	values = np.arange(2 ** (8 * dtype.itemsize), dtype='float32')
+	scale = 255 / max(high - low, 1e-9)
+	return np.clip((values - low) * scale, 0, 255).astype('uint8')
+
+
+def apply_window(image, low, high, lut=None):
+	"""
+	8 bit copy of one slice windowed to low - high
+	"""
+	image = np.asarray(image)
+	if lut is not None: return lut[image]
+	scale = 255 / max(high - low, 1e-9)
+	return np.clip((image.astype('float32') - low) * scale, 0, 255).astype('uint8')
+
+
+def label_lut(colours=None):
+	"""
+	(256, 3) uint8 table of the RGB colour of each label value
+	colours : {value : (r, g, b)}, defaults to 1 red, 2 yellow, 3 blue
+	"""
+	if colours is None: colours = LABEL_COLOURS
+	lut = np.zeros((256, 3), dtype='uint8')
+	for value, colour in colours.items(): lut[value] = colour
+	return lut
+
+
+def overlay(image, label, lut, opacity=1.):
+	"""
+	RGB copy of an 8 bit slice with label colours blended on top
+	only the pixels inside the label are touched
+	"""
+	rgb = np.repeat(image[:, :, np.newaxis], 3, axis=2)
+	mask = np.asarray(label) > 0
+	colour = lut[np.asarray(label)[mask]]
+	if opacity >= 1: rgb[mask] = colour
+	else: rgb[mask] = (rgb[mask] * (1 - opacity) + colour * opacity).astype('uint8')
+	return rgb
+
+
+class ArrayImage(QImage):
+	"""
+	QImage viewing a numpy array without copying it
+	QImage doesn't own the memory it is given so the array is kept alive with the image
+	"""
+
+	def __init__(self, array):
+		array = np.ascontiguousarray(array, dtype='uint8')
+		if array.ndim == 2: fmt = QImage.Format_Grayscale8
+		elif array.ndim == 3 and array.shape[2] == 3: fmt = QImage.Format_RGB888
+		else: raise ValueError('[Viewer] Cant tell if stack is color or grayscale, weird shape :/')
+		height, width = array.shape[:2]
+		super().__init__(array.data, width, height, array.strides[0], fmt)
+		self.array = array
+
+
 class mainView(QMainWindow):
 
-	def __init__(self, stack, label = None, thresh = False):
+	def __init__(self, stack, label = None, thresh = False, colours = None, opacity = 1., pyramid = None):
 		super().__init__()
 		self.thresh = thresh
 		self.label = label
+		self.colours = colours
+		self.opacity = opacity
+		self.pyramid = pyramid
 		self.stack_length = stack.shape[0]
-		# convert 16 bit grayscale to 8 bit
-		# by mapping the data range to 0 - 255
-		if stack.dtype == 'uint16':
-			self.stack = ((stack - stack.min()) / (stack.ptp() / 255.0)).astype(np.uint8) 
-		else:
-			self.stack = stack
+		# keep the original stack, slices are converted to 8 bit when they are shown
+		self.stack = stack
 		self.initUI()
 
 	def initUI(self):
@@ -26,7 +103,8 @@ class mainView(QMainWindow):
 		self.setWindowTitle('CTFishPy')
 		self.statusBar().showMessage('Status bar: Ready')
 
-		self.viewer = Viewer(self.stack, label = self.label, parent = self, thresh = self.thresh)
+		self.viewer = Viewer(self.stack, label = self.label, parent = self, thresh = self.thresh,
+			colours = self.colours, opacity = self.opacity, pyramid = self.pyramid)
 		self.setCentralWidget(self.viewer)
 		#widget.findChildren(QWidget)[0]
 		menubar = self.menuBar()
@@ -37,20 +115,39 @@ class mainView(QMainWindow):
 		#close window if esc or q is pressed
 		if event.key() == Qt.Key_Escape or event.key() == Qt.Key_Q :
 			self.close()
+		# zoom with + and -
+		if event.key() in [Qt.Key_Plus, Qt.Key_Equal]: self.viewer.zoom_by(1)
+		if event.key() == Qt.Key_Minus: self.viewer.zoom_by(-1)
 
 	def updateStatusBar(self, slice_ = 0):
 		self.statusBar().showMessage(f'{slice_}/{self.stack_length}')
 
 
 class Viewer(QWidget):
+	"""
+	Scroll through slices of a stack with window, threshold and label overlay controls
 
-	def __init__(self, stack, label = None, thresh = False, stride = 1, parent = None):
+	Ctrl + wheel or + and - zoom, dragging pans. Only the visible region is read and drawn,
+	from the pyramid level closest to the zoom when a pyramid is given (see CTreader.write_pyramid)
+	or by striding the slice otherwise.
+
+	parameters
+	pyramid : list of volumes each half the size of the last in x and y, pyramid[0] being full resolution
+	viewport : largest side of the shown image in screen pixels, big slices start zoomed out to fit
+	"""
+
+	def __init__(self, stack, label = None, thresh = False, stride = 1, parent = None, colours = None, opacity = 1.,
+				pixmap_cache = 64, frame_ms = 15, pyramid = None, viewport = 800):
 		super().__init__()
 
 		# init variables
-		if np.max(stack) < 10: stack = stack*255 #fix labels so you can view them if are main stack
 		self.ogstack = stack
 		self.stack_size = stack.shape[0]
+		# window from a sample of slices, labels passed as the main stack end up stretched to 0 - 255 too
+		self.range = sample_range(stack)
+		if stack.dtype == 'uint8' and self.range[1] >= 10: self.range = (0., 255.) # already 8 bit so show as is
+		self.window = list(self.range)
+		self.lut = window_lut(*self.window, stack.dtype)
 		self.stride = stride
 		self.slice = 0
 		self.parent = parent
@@ -60,20 +157,30 @@ class Viewer(QWidget):
 		self.label = label
 		self.pad = 20
 
-		# label stack
-		if self.label is not None:
-			self.thresh == False
-			# unpack images to convert each one to grayscale
-			self.ogstack = np.array([np.stack((img,)*3, axis=-1) for img in self.ogstack])
-			# change pixels to red if in label
-			self.ogstack[label == 1, :] = [255, 0, 0]
-			self.ogstack[label == 2, :] = [255, 255, 0]
-			self.ogstack[label == 3, :] = [0, 0, 255]
+		# label colours are blended onto the shown slice only when it is drawn
+		self.label_lut = label_lut(colours)
+		self.opacity = opacity
+
+		# rendered slices keyed by everything that changes how they look
+		self.pixmaps = OrderedDict()
+		self.pixmap_cache = pixmap_cache
+		# slices that aren't cached are drawn at most once a frame however fast the wheel turns
+		self.timer = QTimer(self)
+		self.timer.setSingleShot(True)
+		self.timer.timeout.connect(self.update)
+		self.frame_ms = frame_ms
 
 		#if self.ogstack.shape[0] == self.ogstack.shape[1]: self.is_single_image = True
 		if len(self.ogstack.shape) == 2: self.is_single_image = True
 		else: self.is_single_image = False
 
+		# zoom is screen pixels per full resolution pixel, centre is the [row, col] in the middle of the view
+		self.pyramid = pyramid
+		height, width = self.ogstack.shape[-2:]
+		self.zoom = min(1., viewport / max(height, width))
+		self.view_size = (int(round(height * self.zoom)), int(round(width * self.zoom)))
+		self.centre = [height / 2, width / 2]
+		self.drag = None
 
 		# set background colour to cyan
 		p = self.palette()
@@ -88,107 +195,196 @@ class Viewer(QWidget):
 	def initUI(self):
 		pad = self.pad
 		self.update()
+		# the image area stays the same size however far it is zoomed
+		self.qlabel.setFixedSize(self.view_size[1] + pad, self.view_size[0] + pad)
+		self.sliders = []
 		if self.is_single_image == False:
 			self.initSlider()
 			self.slider.valueChanged.connect(self.updateSlider)
-			self.setGeometry(0, 0, 
-			self.pixmap.width() + pad, 
-			self.pixmap.height() + pad + self.slider.height()*2 + pad)
 
-		elif self.is_single_image: 
-			self.setGeometry(0, 0, 
-			self.pixmap.width() + pad, 
-			self.pixmap.height() + pad*2)
+		self.initWindowSliders()
+		self.min_window_slider.valueChanged.connect(self.update_window)
+		self.max_window_slider.valueChanged.connect(self.update_window)
+
+		if self.label is not None:
+			self.opacity_slider = self.addSlider(0, 100, int(self.opacity * 100))
+			self.opacity_slider.valueChanged.connect(self.update_opacity)
 
 		if self.thresh == True: 
 			self.initThresholdSliders()
-			self.setGeometry(0, 0, 
-				self.pixmap.width() + pad, 
-				self.pixmap.height()+ pad + self.slider.height()*2 + self.min_thresh_slider.height()*2 + self.max_thresh_slider.height()*2)
 			self.min_thresh_slider.valueChanged.connect(self.update_min_thresh)
 			self.max_thresh_slider.valueChanged.connect(self.update_max_thresh)
 
+		self.setGeometry(0, 0, 
+			self.view_size[1] + pad, 
+			self.view_size[0] + pad*2 + 20*len(self.sliders))
+
+	def addSlider(self, minimum, maximum, value):
+		# stack sliders under the image
+		slider = QSlider(Qt.Horizontal, self)
+		slider.setMinimum(minimum)
+		slider.setMaximum(maximum)
+		slider.setSingleStep(1)
+		slider.setValue(value)
+		slider.setGeometry(10, self.view_size[0]+10+20*len(self.sliders), self.view_size[1], 20)
+		self.sliders.append(slider)
+		return slider
+
+	def windowed(self, image):
+		return apply_window(image, *self.window, self.lut)
+
+	def render_key(self):
+		thresh = (self.min_thresh, self.max_thresh) if self.thresh == True else None
+		opacity = self.opacity if self.label is not None else None
+		return (self.slice, tuple(self.window), thresh, opacity, self.zoom, tuple(self.centre))
+
+	def level(self):
+		# pyramid level whose resolution is closest above the zoom
+		level = int(np.floor(np.log2(1 / self.zoom))) if self.zoom < 1 else 0
+		if self.pyramid is not None: level = min(level, len(self.pyramid) - 1)
+		return level
+
+	def visible(self, level):
+		# [r0, r1, c0, c1] of the view at a pyramid level
+		scale = 2 ** level
+		zoom = self.zoom * scale
+		height, width = (-(-n // scale) for n in self.ogstack.shape[-2:])
+		rows = min(int(np.ceil(self.view_size[0] / zoom)), height)
+		cols = min(int(np.ceil(self.view_size[1] / zoom)), width)
+		r0 = int(np.clip(self.centre[0] / scale - rows / 2, 0, height - rows))
+		c0 = int(np.clip(self.centre[1] / scale - cols / 2, 0, width - cols))
+		return r0, r0 + rows, c0, c0 + cols
+
+	def tile(self, source, pyramid=None):
+		level = self.level()
+		r0, r1, c0, c1 = self.visible(level)
+		if pyramid is not None:
+			volume = pyramid[level]
+			return np.asarray(volume[r0:r1, c0:c1] if self.is_single_image else volume[self.slice, r0:r1, c0:c1])
+		# without a pyramid take every scale'th pixel of the visible part of the slice
+		scale = 2 ** level
+		image = source if self.is_single_image else source[self.slice]
+		return np.asarray(image[r0*scale:r1*scale:scale, c0*scale:c1*scale:scale])
+
+	def render(self):
+		self.image = self.windowed(self.tile(self.ogstack, self.pyramid))
+		if self.thresh == True:
+			ret, self.image  = cv2.threshold(self.image, 
+				self.min_thresh, self.max_thresh, cv2.THRESH_BINARY)
+		if self.label is not None:
+			self.image = overlay(self.image, self.tile(self.label), self.label_lut, self.opacity)
+		# scale what is left of the zoom after picking the level
+		zoom = self.zoom * 2 ** self.level()
+		if zoom != 1:
+			size = (int(round(self.image.shape[1] * zoom)), int(round(self.image.shape[0] * zoom)))
+			self.image = cv2.resize(self.image, size, interpolation=cv2.INTER_NEAREST if zoom > 1 else cv2.INTER_AREA)
+		return QPixmap.fromImage(self.np2qt(self.image))
+
+	def zoom_by(self, steps):
+		self.zoom = float(np.clip(self.zoom * 1.25 ** steps, 1 / 256, 16))
+		self.schedule()
+
+	def mousePressEvent(self, event):
+		self.drag = (event.pos().x(), event.pos().y())
+
+	def mouseMoveEvent(self, event):
+		if self.drag is None: return
+		x, y = event.pos().x(), event.pos().y()
+		self.centre[0] -= (y - self.drag[1]) / self.zoom
+		self.centre[1] -= (x - self.drag[0]) / self.zoom
+		height, width = self.ogstack.shape[-2:]
+		self.centre = [float(np.clip(self.centre[0], 0, height)), float(np.clip(self.centre[1], 0, width))]
+		self.drag = (x, y)
+		self.schedule()
+
+	def mouseReleaseEvent(self, event):
+		self.drag = None
 
 	def update(self):
 
 		if self.slice > self.stack_size-1: 	self.slice = 0
 		if self.slice < 0: 					self.slice = self.stack_size-1
-		
-		if self.thresh == True:
-			ret, self.image  = cv2.threshold(self.ogstack[self.slice], 
-				self.min_thresh, self.max_thresh, cv2.THRESH_BINARY)
-		elif self.is_single_image == True: self.image = self.ogstack
-		else: self.image = self.ogstack[self.slice]
 
-		# transform image to qimage and set pixmap
-		self.image = self.np2qt(self.image)
-		self.pixmap = QPixmap(QPixmap.fromImage(self.image))
+		key = self.render_key()
+		if key in self.pixmaps:
+			self.pixmaps.move_to_end(key)
+		else:
+			self.pixmaps[key] = self.render()
+			if len(self.pixmaps) > self.pixmap_cache: self.pixmaps.popitem(last=False)
+		self.pixmap = self.pixmaps[key]
 		self.qlabel.setPixmap(self.pixmap)
 
+	def schedule(self):
+		# cached slices are drawn straight away, others on the next frame
+		if self.render_key() in self.pixmaps: self.update()
+		elif not self.timer.isActive(): self.timer.start(self.frame_ms)
+
 	def wheelEvent(self, event):
+		if event.modifiers() & Qt.ControlModifier:
+			self.zoom_by(int(event.angleDelta().y()/120))
+			return
 		if self.is_single_image: return
 		#scroll through slices and go to beginning if reached max
-		self.slice = self.slice + int(event.angleDelta().y()/120)*self.stride
+		step = int(event.angleDelta().y()/120)*self.stride
+		self.slice = self.slice + step
 		if self.slice > self.stack_size-1: 	self.slice = 0
 		if self.slice < 0: 					self.slice = self.stack_size-1
+		self.prefetch(step)
 		self.slider.setValue(self.slice)
-		self.update()
+		self.schedule()
 
 	def np2qt(self, image):
-		# transform np cv2 image to qt format
-
-		# check length of image shape to check if image is grayscale or color
-		if len(image.shape) == 2: grayscale = True
-		elif len(image.shape) == 3: grayscale = False
-		else: raise ValueError('[Viewer] Cant tell if stack is color or grayscale, weird shape :/')
-		if self.is_single_image: grayscale = True
-
-		# convert npimage to qimage depending on color mode
-		if grayscale == True:
-			height, width = self.image.shape
-			bytesPerLine = width
-			return QImage(image.data, width, height, bytesPerLine, QImage.Format_Indexed8)
-		else:
-			height, width, channel = image.shape
-			bytesPerLine = 3 * width
-			return QImage(image.data, width, height, bytesPerLine, QImage.Format_RGB888)
+		# transform np cv2 image to qt format without copying it
+		return ArrayImage(image)
 
 	def initSlider(self):
-		self.slider = QSlider(Qt.Horizontal, self)
-		self.slider.setMinimum(0)
-		self.slider.setMaximum(self.stack_size)
-		self.slider.setGeometry(10, self.pixmap.height()+10, self.pixmap.width(), 20)
+		self.slider = self.addSlider(0, self.stack_size-1, 0)
+
+	def prefetch(self, step):
+		# stacks read from disk through a SliceCache can read ahead in the scroll direction
+		if step == 0: return
+		if hasattr(self.ogstack, 'prefetch'): self.ogstack.prefetch(self.slice, step)
+		if hasattr(self.label, 'prefetch'): self.label.prefetch(self.slice, step)
 
 	def updateSlider(self):
+		self.prefetch(self.slider.value() - self.slice)
 		self.slice = self.slider.value()
-		self.update()
+		self.schedule()
 		self.parent.updateStatusBar(self.slice)
 
+	def initWindowSliders(self):
+		# window sliders move in 1/1000ths of the sampled data range
+		self.min_window_slider = self.addSlider(0, 1000, 0)
+		self.max_window_slider = self.addSlider(0, 1000, 1000)
+
+	def update_window(self):
+		low, high = self.range
+		step = (high - low) / 1000
+		self.window = [low + self.min_window_slider.value() * step, low + self.max_window_slider.value() * step]
+		# rebuilding the table is one pass over 65536 values, no matter how big the stack is
+		self.lut = window_lut(*self.window, self.ogstack.dtype)
+		self.schedule()
+
+	def update_opacity(self):
+		self.opacity = self.opacity_slider.value() / 100
+		self.schedule()
+
 	def initThresholdSliders(self):
-		self.min_thresh_slider = QSlider(Qt.Horizontal, self)
-		self.min_thresh_slider.setMinimum(0) # betweeen 100 and 200
-		self.min_thresh_slider.setMaximum(150) # -for decimal places
-		self.min_thresh_slider.setSingleStep(1)
-		self.min_thresh_slider.setGeometry(10, self.pixmap.height()+10+self.slider.height(), self.pixmap.width(), 20)
-		
-		self.max_thresh_slider = QSlider(Qt.Horizontal, self)
-		self.max_thresh_slider.setMinimum(100)
-		self.max_thresh_slider.setMaximum(255)
-		self.max_thresh_slider.setSingleStep(1)
-		self.max_thresh_slider.setGeometry(10, self.pixmap.height()+10+self.slider.height()+self.min_thresh_slider.height(), self.pixmap.width(), 20)
+		self.min_thresh_slider = self.addSlider(0, 150, self.min_thresh)
+		self.max_thresh_slider = self.addSlider(100, 255, self.max_thresh)
 
 	def update_min_thresh(self):
 		self.min_thresh = self.min_thresh_slider.value() # divide by 100 to get decimal points
-		self.update()
+		self.schedule()
 
 	def update_max_thresh(self):
 		self.max_thresh = self.max_thresh_slider.value() # divide by 100 to get decimal points
-		self.update()
+		self.schedule()
 
 
-def mainViewer(stack, label, thresh):
+def mainViewer(stack, label, thresh, colours=None, opacity=1., pyramid=None):
 	app = QApplication(sys.argv)
-	win = mainView(stack, label, thresh)
+	win = mainView(stack, label, thresh, colours, opacity, pyramid)
 	win.show()
 	app.exec_()
 	return
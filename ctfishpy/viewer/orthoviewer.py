@@ -0,0 +1,134 @@
+from qtpy.QtWidgets import QMainWindow, QApplication, QWidget, QLabel, QHBoxLayout
+from qtpy.QtGui import QPixmap
+from qtpy.QtCore import Qt
+from .mainviewer import sample_range, window_lut, apply_window, label_lut, overlay, ArrayImage
+from collections import OrderedDict
+import numpy as np
+import cv2
+import sys
+
+PANES = ['axial', 'sagittal', 'coronal'] # looking along axis 0, 1 and 2
+
+
+class OrthoSlicer():
+	"""
+	Slices of a volume along any axis, gathered when asked for and cached
+
+	Off axis slices are indexed straight from the volume as volume[:, i] or volume[:, :, i],
+	a view for numpy arrays and a partial read for h5py datasets, so no transposed copy is made.
+	Tiff volumes have to read every slice for an off axis plane, use a Compressed/ store for big scans.
+
+	parameters
+	volume : numpy array, h5py dataset, SliceCache or TiffVolume
+	size : off axis slices kept in memory
+	"""
+
+	def __init__(self, volume, size=8):
+		self.volume = volume
+		self.shape = volume.shape
+		self.dtype = volume.dtype
+		self.size = size
+		self.planes = OrderedDict()
+
+	def get(self, axis, i):
+		if axis == 0: return np.asarray(self.volume[i])
+		key = (axis, i)
+		if key in self.planes:
+			self.planes.move_to_end(key)
+			return self.planes[key]
+		index = (slice(None), i) if axis == 1 else (slice(None), slice(None), i)
+		plane = np.asarray(self.volume[index])
+		self.planes[key] = plane
+		if len(self.planes) > self.size: self.planes.popitem(last=False)
+		return plane
+
+
+class OrthoView(QWidget):
+	"""
+	Linked axial, sagittal and coronal panes with a shared crosshair
+
+	Click a pane to move the crosshair there, scroll a pane to move along its axis.
+	"""
+
+	def __init__(self, stack, label = None, colours = None, opacity = 1., parent = None):
+		super().__init__()
+		self.stack = OrthoSlicer(stack)
+		self.label = OrthoSlicer(label) if label is not None else None
+		self.parent = parent
+		# [z, x, y] of the crosshair
+		self.position = [s // 2 for s in self.stack.shape]
+		self.window = list(sample_range(stack))
+		self.lut = window_lut(*self.window, stack.dtype)
+		self.label_lut = label_lut(colours)
+		self.opacity = opacity
+		self.crosshair = (0, 255, 0)
+
+		layout = QHBoxLayout(self)
+		self.panes = []
+		for axis in range(3):
+			pane = QLabel(self)
+			# keep the pixmap at the pane's origin so click positions are voxel positions
+			pane.setAlignment(Qt.AlignTop | Qt.AlignLeft)
+			pane.mousePressEvent = lambda event, axis=axis : self.click(axis, event)
+			pane.wheelEvent = lambda event, axis=axis : self.scroll(axis, event)
+			layout.addWidget(pane)
+			self.panes.append(pane)
+		self.update()
+
+	def plane_axes(self, axis):
+		# axes of the volume along the rows and columns of a pane
+		return [a for a in range(3) if a != axis]
+
+	def render(self, axis):
+		image = apply_window(self.stack.get(axis, self.position[axis]), *self.window, self.lut)
+		if self.label is not None:
+			image = overlay(image, self.label.get(axis, self.position[axis]), self.label_lut, self.opacity)
+		else:
+			image = np.repeat(image[:, :, np.newaxis], 3, axis=2)
+		row, col = (self.position[a] for a in self.plane_axes(axis))
+		cv2.line(image, (0, row), (image.shape[1]-1, row), self.crosshair, 1)
+		cv2.line(image, (col, 0), (col, image.shape[0]-1), self.crosshair, 1)
+		return image
+
+	def update(self):
+		for axis, pane in enumerate(self.panes):
+			pane.setPixmap(QPixmap.fromImage(ArrayImage(self.render(axis))))
+		if self.parent is not None: self.parent.updateStatusBar(self.position)
+
+	def click(self, axis, event):
+		rows, cols = self.plane_axes(axis)
+		self.position[rows] = int(np.clip(event.pos().y(), 0, self.stack.shape[rows]-1))
+		self.position[cols] = int(np.clip(event.pos().x(), 0, self.stack.shape[cols]-1))
+		self.update()
+
+	def scroll(self, axis, event):
+		step = int(event.angleDelta().y()/120)
+		self.position[axis] = int(np.clip(self.position[axis] + step, 0, self.stack.shape[axis]-1))
+		if axis == 0 and hasattr(self.stack.volume, 'prefetch'): self.stack.volume.prefetch(self.position[0], step)
+		self.update()
+
+
+class orthoView(QMainWindow):
+
+	def __init__(self, stack, label = None, colours = None, opacity = 1.):
+		super().__init__()
+		self.setWindowTitle('CTFishPy')
+		self.viewer = OrthoView(stack, label, colours, opacity, parent = self)
+		self.setCentralWidget(self.viewer)
+
+	def keyPressEvent(self, event):
+		#close window if esc or q is pressed
+		if event.key() == Qt.Key_Escape or event.key() == Qt.Key_Q :
+			self.close()
+
+	def updateStatusBar(self, position):
+		z, x, y = position
+		self.statusBar().showMessage(f'z {z} x {x} y {y}')
+
+
+def orthoViewer(stack, label=None, colours=None, opacity=1.):
+	app = QApplication(sys.argv)
+	win = orthoView(stack, label, colours, opacity)
+	win.show()
+	app.exec_()
+	return win.viewer.position
@@ -0,0 +1,109 @@
+from collections import OrderedDict
+import tifffile as tiff
+import numpy as np
+import threading
+import queue
+
+
+class TiffVolume():
+	"""
+	A scan on disk that reads one tiff slice when it is indexed, so it can be viewed without reading it all
+
+	parameters
+	paths : sorted tiff paths, one per slice
+	transform : optional function applied to every slice read, e.g. rotation to align it
+	"""
+
+	def __init__(self, paths, transform=None):
+		self.paths = [str(p) for p in paths]
+		self.transform = transform
+		first = self.read(0)
+		self.shape = (len(self.paths),) + first.shape
+		self.dtype = first.dtype
+
+	def __len__(self):
+		return len(self.paths)
+
+	def read(self, i):
+		image = tiff.imread(self.paths[i])
+		if self.transform is not None: image = self.transform(image)
+		return image
+
+	def __getitem__(self, i):
+		# only the slices needed are read, then the other axes are indexed
+		if isinstance(i, tuple): z, rest = i[0], i[1:]
+		else: z, rest = i, ()
+		if isinstance(z, (int, np.integer)): return self.read(int(z))[rest]
+		return np.stack([self.read(j) for j in range(len(self))[z]])[(slice(None),) + rest]
+
+
+class SliceCache():
+	"""
+	LRU cache of decoded slices in front of a volume with a background thread reading ahead
+
+	Viewers call prefetch(slice, direction) when they move so the next slices
+	in the scroll direction are usually decoded before they are asked for.
+
+	parameters
+	volume : anything indexed by slice with shape and dtype, e.g. TiffVolume, h5py dataset, np.memmap
+	size : slices kept in memory
+	ahead : slices read ahead of the current one
+	"""
+
+	def __init__(self, volume, size=64, ahead=8):
+		self.volume = volume
+		self.shape = volume.shape
+		self.dtype = volume.dtype
+		self.size = size
+		self.ahead = ahead
+		self.slices = OrderedDict()
+		self.lock = threading.Lock()
+		self.requests = queue.Queue()
+		self.hits = 0
+		self.misses = 0
+		self.thread = threading.Thread(target=self._work, daemon=True)
+		self.thread.start()
+
+	def __len__(self):
+		return self.shape[0]
+
+	def _get(self, i):
+		with self.lock:
+			if i in self.slices:
+				self.slices.move_to_end(i)
+				return self.slices[i]
+		return None
+
+	def _put(self, i, image):
+		with self.lock:
+			self.slices[i] = image
+			self.slices.move_to_end(i)
+			while len(self.slices) > self.size: self.slices.popitem(last=False)
+
+	def __getitem__(self, i):
+		if not isinstance(i, (int, np.integer)): return self.volume[i]
+		i = int(i)
+		image = self._get(i)
+		if image is not None:
+			self.hits += 1
+			return image
+		self.misses += 1
+		image = np.asarray(self.volume[i])
+		self._put(i, image)
+		return image
+
+	def prefetch(self, i, direction=1):
+		"""
+		Queue reading the slices after i in direction, replacing any older requests
+		"""
+		while True:
+			try: self.requests.get_nowait()
+			except queue.Empty: break
+		direction = 1 if direction >= 0 else -1
+		for j in range(i + direction, i + direction * (self.ahead + 1), direction):
+			if 0 <= j < self.shape[0]: self.requests.put(j)
+
+	def _work(self):
+		while True:
+			i = self.requests.get()
+			if self._get(i) is None: self._put(i, np.asarray(self.volume[i]))
@@ -0,0 +1,11 @@
+import ctfishpy
+
+
+
+if __name__ == "__main__":
+	aligner = ctfishpy.Aligner()
+	# fill in angles of new fish then spin the ones it couldn't decide by hand
+	estimated = aligner.estimate_many(workers=8)
+	ambiguous = [fish for fish, score in estimated.items() if score['ambiguous']]
+	print(f'{len(estimated)} angles estimated, {len(ambiguous)} ambiguous')
+	if ambiguous: aligner.review(ambiguous)
@@ -0,0 +1,24 @@
+import ctfishpy
+import argparse
+
+ap = argparse.ArgumentParser(description="Export the trained unet for cpu inference and benchmark it")
+ap.add_argument("-f", "--format", type=str, default="tflite", choices=["savedmodel", "tflite", "onnx"],
+	help="artifact format")
+ap.add_argument("-q", "--quantize", type=str, default=None, choices=["float16", "int8"],
+	help="tflite quantization, int8 is dynamic range")
+ap.add_argument("-o", "--out", type=str, default=None,
+	help="path of the exported model")
+ap.add_argument("-b", "--benchmark", type=int, nargs="?", const=-1, default=None,
+	help="benchmark against the keras model on this fish, first validation fish if no number given")
+ap.add_argument("--threads", type=int, default=None,
+	help="cpu threads for the exported model")
+args = vars(ap.parse_args())
+
+if __name__ == "__main__":
+	unet = ctfishpy.Unet()
+	path = ctfishpy.export_model(unet, fmt=args['format'], quantize=args['quantize'], path=args['out'])
+
+	if args['benchmark'] is not None:
+		n = None if args['benchmark'] == -1 else args['benchmark']
+		predictor = ctfishpy.Predictor(unet)
+		ctfishpy.benchmark(predictor, [path], n=n, threads=args['threads'])
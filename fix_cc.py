@@ -1,24 +1,21 @@
 import ctfishpy
-import matplotlib.pyplot as plt
-import pandas as pd
-import numpy as np
-import cv2
 import json
 
 
 
 if __name__ == "__main__":
 	ctreader = ctfishpy.CTreader()
-	datapath = ctreader.dataset_path / 'cc_centres_otoliths.json'
+	localiser = ctfishpy.Localiser('Otoliths', ctreader=ctreader)
 
-	sample = [40,78,200,218,240,277,330,337,341,462,464,364]
-	centres = {}
-	for fish in sample:
-		positions = ctreader.cc_fixer(fish)
-		centres[str(fish)] = positions
-	with open(datapath, 'w') as f:
+	# locate every new fish in 3d and only click through the ones it isn't sure about
+	min_confidence = 10
+	located = localiser.locate_many(mode='3d', factor=4, workers=2)
+	unsure = [fish for fish, score in located.items() if score['confidence'] < min_confidence]
+	print(f'{len(located)} fish located, {len(unsure)} to check by hand')
+
+	with open(localiser.centres_path, 'r') as fp:
+		centres = json.load(fp)
+	for fish in unsure:
+		centres[str(fish)] = ctreader.cc_fixer(fish)
+	with open(localiser.centres_path, 'w') as f:
 		json.dump(centres, f, sort_keys=True, indent=4)
-	with open(datapath, 'r') as fp:
-		data = json.load(fp)
-	print(data)
-		
\ No newline at end of file
@@ -0,0 +1,21 @@
+import ctfishpy
+import argparse
+
+ap = argparse.ArgumentParser(description="Make a fake dataset with the DATASET_PATH layout for benchmarks and tests")
+ap.add_argument("path", type=str,
+	help="folder to write the dataset to")
+ap.add_argument("-f", "--fish", type=int, default=8,
+	help="number of fish")
+ap.add_argument("--first", type=int, default=40,
+	help="number of the first fish")
+ap.add_argument("-s", "--shape", type=int, nargs=3, default=[200, 256, 256],
+	help="z x y size of each scan")
+ap.add_argument("-l", "--labelled", type=float, default=0.75,
+	help="fraction of fish with labels")
+ap.add_argument("--seed", type=int, default=0)
+args = vars(ap.parse_args())
+
+if __name__ == "__main__":
+	dataset = ctfishpy.SyntheticDataset(args['path'], fish_nums=range(args['first'], args['first'] + args['fish']),
+		shape=args['shape'], labelled=args['labelled'], seed=args['seed'])
+	dataset.generate()
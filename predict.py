@@ -1,10 +1,35 @@
 import ctfishpy
-import matplotlib.pyplot as plt
-import numpy as np
+import argparse
 
-ctreader = ctfishpy.CTreader()
-unet = ctfishpy.Unet()
-label = unet.predict(40)
-print(label.shape, np.max(label), np.unique(label))
-ctreader.write_label(label, 'Otoliths-unet', 40)
-plt.imsave('output/Images/second_prediction2.png', label[120])
\ No newline at end of file
+ap = argparse.ArgumentParser(description="Predict labels for many fish, resuming where the last run stopped")
+ap.add_argument("fish", type=int, nargs="*",
+	help="fish numbers to predict, all fish in the dataset if none are given")
+ap.add_argument("-n", "--name", type=str, default=None,
+	help="label store to write to, defaults to <organ>-unet")
+ap.add_argument("-t", "--tiled", action="store_true",
+	help="segment whole scans instead of the roi around the cc centre")
+ap.add_argument("-c", "--clean", action="store_true",
+	help="keep only the largest connected component of each class")
+ap.add_argument("-p", "--pipelined", action="store_true",
+	help="overlap reading, aligning, inference and writing in separate stages")
+ap.add_argument("--read-workers", type=int, default=2,
+	help="threads reading tiffs when pipelined")
+ap.add_argument("--preprocess-workers", type=int, default=2,
+	help="threads aligning and cropping when pipelined")
+ap.add_argument("--intra-op", type=int, default=0,
+	help="tensorflow intra op threads, 0 for default")
+ap.add_argument("--inter-op", type=int, default=0,
+	help="tensorflow inter op threads, 0 for default")
+args = vars(ap.parse_args())
+
+if __name__ == "__main__":
+	ctfishpy.set_tf_threads(args['intra_op'], args['inter_op'])
+	unet = ctfishpy.Unet()
+	predictor = ctfishpy.Predictor(unet)
+	job = ctfishpy.PredictionJob(predictor, name=args['name'], tiled=args['tiled'], clean=args['clean'])
+	if args['pipelined']:
+		manifest = job.run_pipelined(args['fish'] or None, read_workers=args['read_workers'],
+			preprocess_workers=args['preprocess_workers'])
+	else:
+		manifest = job.run(args['fish'] or None)
+	print(f"[CTFishPy] {len(manifest['done'])} fish done, {len(manifest['failed'])} failed")
@@ -0,0 +1,76 @@
+import ctfishpy
+import numpy as np
+import pytest
+import json
+import os
+
+SHAPE = (48, 64, 80) # not cubic so swapped axes show up as wrong shapes
+
+
+@pytest.fixture(scope='module')
+def dataset(tmp_path_factory):
+	path = tmp_path_factory.mktemp('synthetic')
+	designs = ctfishpy.SyntheticDataset(path, fish_nums=[1, 2], shape=SHAPE, labelled=1., seed=3).generate()
+	old = os.getcwd(), os.environ.get('DATASET_PATH')
+	# CTreader reads DATASET_PATH and ./uCT_mastersheet.csv
+	os.environ['DATASET_PATH'] = str(path)
+	os.chdir(path)
+	yield path, designs, ctfishpy.CTreader()
+	os.chdir(old[0])
+	if old[1] is None: del os.environ['DATASET_PATH']
+	else: os.environ['DATASET_PATH'] = old[1]
+
+
+def blob_voxels(design):
+	# centre of every otolith blob and its class
+	return [(c, tuple(int(round(v)) for v in centre)) for c, centre, radius in design['blobs']]
+
+
+def test_fish_and_mastersheet(dataset):
+	path, designs, ctreader = dataset
+	assert ctreader.fish_nums == [1, 2]
+	assert sorted(ctreader.mastersheet()['n']) == [1, 2]
+
+
+def test_read_aligned(dataset):
+	path, designs, ctreader = dataset
+	for n, design in designs.items():
+		ct, metadata = ctreader.read(n, align=True)
+		assert ct.shape == SHAPE
+		assert metadata['angle'] == design['angle']
+		for c, (z, x, y) in blob_voxels(design):
+			assert ct[z, x, y] > 30000
+
+
+def test_read_label(dataset):
+	path, designs, ctreader = dataset
+	for n, design in designs.items():
+		label = ctreader.read_label('Otoliths', n)
+		assert label.shape == SHAPE
+		for c, (z, x, y) in blob_voxels(design):
+			assert label[z, x, y] == c
+
+
+def test_max_projections(dataset):
+	path, designs, ctreader = dataset
+	depth, x, y = SHAPE
+	for n, design in designs.items():
+		z_png, y_png, x_png = ctreader.read_max_projections(n)
+		# same axes as Archive/make_projections.py
+		assert z_png.shape[:2] == (x, y)
+		assert y_png.shape[:2] == (depth, x)
+		assert x_png.shape[:2] == (depth, y)
+		for c, (bz, bx, by) in blob_voxels(design):
+			assert z_png[bx, by].max() > 200
+			assert y_png[bz, bx].max() > 200
+			assert x_png[bz, by].max() > 200
+
+
+def test_cc_centres(dataset):
+	path, designs, ctreader = dataset
+	with open(path / 'Metadata/cc_centres_Otoliths.json', 'r') as fp:
+		centres = json.load(fp)
+	for n, design in designs.items():
+		label = ctreader.read_label('Otoliths', n)
+		middle = np.mean(np.nonzero(label), axis=1)
+		assert np.abs(np.array(centres[str(n)]) - middle).max() <= 2